@@ -0,0 +1,138 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import itertools
+import logging
+import os
+import time
+from config import get_config
+import clients, prompts, hedging, jobs
+from generate import (check_file_names, iter_markdown_files, read_for_processing, parse_for_prompt, finish_file,
+                      file_failed, file_logger)
+from metrics import get_run_metrics
+from tqdm.auto import tqdm
+
+
+class BoundedAsyncClient:
+    """Wraps a Bedrock client so that at most `max_in_flight` invoke_model calls run at once.
+
+    The wrapped client may expose either a coroutine `invoke_model` (an async SDK, or
+    fake_bedrock.AsyncFakeBedrockClient), which runs on the event loop with no extra
+    threads, or the blocking boto3 one, which is then run on a private thread pool
+    sized to the in-flight limit.
+    """
+
+    def __init__(self, client, max_in_flight):
+        self.client = client
+        self.max_in_flight = max_in_flight
+        self.is_async = clients.is_async_client(client)
+        self._semaphore = None
+        self._executor = None
+
+    def slot(self):
+        """The in-flight limit, as an async context manager."""
+        # Created lazily so the semaphore binds to the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    async def invoke_model(self, **kwargs):
+        async with self.slot():
+            if self.is_async:
+                return await self.client.invoke_model(**kwargs)
+
+            return await self._run_in_executor(lambda: self.client.invoke_model(**kwargs))
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call that uses the wrapped client (e.g. reading a response stream) under the in-flight limit."""
+        async with self.slot():
+            return await self._run_in_executor(lambda: func(*args))
+
+    async def _run_in_executor(self, call):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_in_flight, thread_name_prefix="bedrock")
+        loop = asyncio.get_running_loop()
+        # Carry the caller's context (e.g. the file deadline) into the worker thread.
+        return await loop.run_in_executor(self._executor, contextvars.copy_context().run, call)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+async def process_single_file_async(file_path, bedrock_client, result_cache=None, config=None):
+    config = config or get_config()
+    logger = file_logger(file_path)
+    logger.info(f"Processing file: {file_path}")
+
+    try:
+        start = time.perf_counter()
+        content, cache_key, cached = read_for_processing(file_path, result_cache, config, logger)
+        if cached:
+            return cached
+
+        markdown, prompt_content = parse_for_prompt(content, file_path, config, logger)
+        with hedging.file_deadline(config.get('FILE_DEADLINE_SECONDS', 0)):
+            abstract, new_title = await prompts.generate_abstract_and_title_async(
+                bedrock_client, prompt_content, markdown.title, os.path.basename(file_path), config)
+        return finish_file(file_path, markdown, abstract, new_title, start, result_cache, cache_key, logger)
+    except Exception as e:
+        return file_failed(file_path, e, logger)
+
+
+async def _gather_with_progress(tasks, window):
+    """Run the (job, coroutine) pairs from the `tasks` iterator, keeping at most `window` started at a time."""
+    pending = {}
+
+    def start_next(count):
+        for job, coro in itertools.islice(tasks, count):
+            pending[asyncio.ensure_future(coro)] = job
+
+    with tqdm(desc="Processing files", unit="file") as pbar:
+        start_next(window)
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                job = pending.pop(task)
+                result = task.result()
+                job.record(result)
+                if result:
+                    get_run_metrics().increment("files_processed")
+                pbar.update(1)
+            start_next(window - len(pending))
+
+
+def process_jobs_async(job_list, bedrock_client, max_in_flight):
+    """Async counterpart of generate.process_jobs.
+
+    Every file runs its abstract -> title chain as a coroutine on one event
+    loop; coroutines are started from each job in turn, and the number of
+    concurrent Bedrock requests across all jobs is bounded by max_in_flight
+    rather than by a thread count.
+    """
+    logger = logging.getLogger("MarkdownProcessor")
+    for job in job_list:
+        check_file_names(job.directory, job.config)
+    for job in job_list:
+        logger.info(f"Processing markdown files in directory (async engine): {job.directory}")
+
+    client = BoundedAsyncClient(bedrock_client, max_in_flight)
+    if not client.is_async:
+        logger.info(f"Bedrock client is blocking, so its calls run on up to {max_in_flight} threads; "
+                    f"an async client factory runs them on the event loop")
+    try:
+        tasks = jobs.tag_groups(job_list, lambda job: (
+            process_single_file_async(file_path, client, job.result_cache, job.config)
+            for file_path in iter_markdown_files(job.directory, job.completed, job.shard, job.config)))
+        asyncio.run(_gather_with_progress(tasks, 2 * client.max_in_flight))
+    finally:
+        client.close()
+
+    for job in job_list:
+        logger.info(f"Processed {job.processed} markdown files for {job.name}.")
+        if job.result_cache is not None:
+            logger.info(job.result_cache.summary())
+            job.result_cache.evict()
+
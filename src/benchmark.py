@@ -0,0 +1,338 @@
+"""Offline benchmarks that need no AWS access.
+
+Usage:
+    python src/benchmark.py [SCENARIO ...] [--output results.json]
+
+Each scenario returns a dict of measurements; the combined results are printed
+and written as JSON so runs can be compared in review. Bedrock is replaced by
+fake_bedrock.FakeBedrockClient and the documents by a synthetic tree.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import yaml
+import compact
+import config as config_module
+import document
+import fake_bedrock
+import generate
+import hedging
+import logging_config
+import metrics
+import modify
+import synthetic
+import throttle
+import utils
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def _emit_file_logs(get_logger, filename):
+    # Roughly the records one file produces on its way through process_single_file.
+    for stage in ("FileProcessor", "FileReader", "AbstractGenerator", "TitleGenerator", "FileProcessor"):
+        logger = get_logger(stage, filename)
+        logger.info(f"Processing {filename} in {stage}...")
+        logger.info(f"Finished {filename} in {stage}.")
+
+
+def _time_logging(get_logger, use_queue, files, workers):
+    with tempfile.TemporaryDirectory() as log_dir:
+        logging_config.setup_logging(log_dir=log_dir, use_queue=use_queue)
+        loggers_before = len(logging.Logger.manager.loggerDict)
+
+        def run(filename):
+            start = time.perf_counter()
+            _emit_file_logs(get_logger, filename)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            per_file = list(executor.map(run, (f"bench-{i}.md" for i in range(files))))
+        worker_seconds = time.perf_counter() - start
+        logging_config.stop_logging()
+
+        return {
+            "worker_wall_seconds": round(worker_seconds, 4),
+            "overhead_per_file_us": round(sum(per_file) / files * 1e6, 1),
+            "loggers_created": len(logging.Logger.manager.loggerDict) - loggers_before,
+        }
+
+
+@scenario("logging")
+def bench_logging(args):
+    """Time spent in logging calls per file: per-file loggers with synchronous handlers vs. fixed loggers on a queue."""
+    run_id = time.monotonic_ns()
+
+    def per_file_logger(stage, filename):
+        return logging.getLogger(f"{stage}-{run_id}-{filename}")
+
+    def fixed_logger(stage, filename):
+        return logging.LoggerAdapter(logging.getLogger(stage), {"doc": filename})
+
+    return {
+        "files": args.files,
+        "workers": args.workers,
+        "per_file_loggers_sync": _time_logging(per_file_logger, False, args.files, args.workers),
+        "fixed_loggers_queue": _time_logging(fixed_logger, True, args.files, args.workers),
+    }
+
+
+def _load_bench_config(directory, **overrides):
+    settings = {
+        "SERVICE_NAME": "Amazon EKS",
+        "BEDROCK_MODEL": "anthropic.claude-3-sonnet-20240229-v1:0",
+        "MAX_FILES": 1000000,
+        "MAX_WORKERS": 10,
+    }
+    settings.update(overrides)
+    path = os.path.join(directory, "bench-config.yaml")
+    with open(path, 'w') as f:
+        yaml.safe_dump(settings, f)
+    config_module.load_config(path)
+
+
+def _create_fake_client(args):
+    return fake_bedrock.FakeBedrockClient(
+        latency_ms=args.latency_ms, latency_distribution=args.latency_distribution,
+        throttle_rate=args.throttle_rate, response_chars=args.response_chars,
+        chunk_delay_ms=args.chunk_delay_ms, seed=args.seed)
+
+
+def _run_generate(directory, markdown_directory, files, workers, args):
+    _load_bench_config(directory, MAX_WORKERS=workers, STREAMING_ENABLED=args.streaming,
+                       HEDGING_ENABLED=bool(args.hedge_percentile), HEDGE_PERCENTILE=args.hedge_percentile,
+                       BEDROCK_CALL_DEADLINE_SECONDS=args.call_deadline)
+    logging_config.setup_logging(log_dir=os.path.join(directory, "logs"), use_queue=True)
+    client = _create_fake_client(args)
+    controller = throttle.RateController(max_concurrency=workers)
+    # A short backoff so throttled runs measure the retry overhead, not the sleep.
+    throttled_client = throttle.ThrottledBedrockClient(client, controller, base_delay=0.05, max_delay=1.0)
+    bedrock_client, hedged_client = hedging.create_hedged_client(
+        throttled_client, client, controller, config_module.get_config(), workers)
+
+    run_metrics = metrics.start_run()
+    start = time.perf_counter()
+    results = generate.process_markdown_files(markdown_directory, bedrock_client)
+    elapsed = time.perf_counter() - start
+    logging_config.stop_logging()
+    if hedged_client is not None:
+        hedged_client.close()
+
+    report = run_metrics.report()
+    stages = report["stages"]
+    return {
+        "workers": workers,
+        "files": files,
+        "completed": len(results),
+        "wall_seconds": round(elapsed, 3),
+        "files_per_minute": round(len(results) / elapsed * 60, 1),
+        "bedrock_calls": client.calls,
+        "throttles": client.throttles,
+        "max_in_flight": client.max_in_flight,
+        "stage_p50_seconds": {name: stats["p50_seconds"] for name, stats in stages.items()},
+        "stage_p95_seconds": {name: stats["p95_seconds"] for name, stats in stages.items()},
+        "output_tokens": report["tokens"]["output"],
+        "stragglers": {key: value for key, value in report["stragglers"].items() if key != "slowest_files"},
+        "hedging": hedged_client.as_dict() if hedged_client is not None else None,
+    }
+
+
+@scenario("generate")
+def bench_generate(args):
+    """Throughput of generate.process_markdown_files against the fake client, sweeping MAX_WORKERS and file counts."""
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for files in args.file_sweep:
+            markdown_directory = os.path.join(directory, f"markdown-{files}")
+            synthetic.generate_markdown_tree(markdown_directory, files, mean_chars=args.markdown_chars, seed=args.seed)
+            for workers in args.worker_sweep:
+                print(f"  generate: {files} files, {workers} workers", file=sys.stderr)
+                runs.append(_run_generate(directory, markdown_directory, files, workers, args))
+    return {
+        "latency_ms": args.latency_ms,
+        "latency_distribution": args.latency_distribution,
+        "throttle_rate": args.throttle_rate,
+        "response_chars": args.response_chars,
+        "streaming": args.streaming,
+        "hedge_percentile": args.hedge_percentile,
+        "runs": runs,
+    }
+
+
+def _time_modify(csv_path, xml_directory, workers):
+    start = time.perf_counter()
+    # modify_xml_files prints its report; keep stdout for the JSON results.
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = modify.modify_xml_files(csv_path, xml_directory, workers=workers)
+    return time.perf_counter() - start, report
+
+
+@scenario("modify_xml")
+def bench_modify_xml(args):
+    """modify.modify_xml_files over synthetic DocBook trees of increasing size: a first pass that inserts
+    content into every section, then a second pass where every section already has it."""
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        logging_config.setup_logging(log_dir=os.path.join(directory, "logs"), use_queue=True)
+        for files in args.xml_sweep:
+            for workers in sorted({1, args.xml_workers}):
+                print(f"  modify_xml: {files} files, {workers} workers", file=sys.stderr)
+                xml_directory = os.path.join(directory, f"xml-{files}-{workers}")
+                sections = synthetic.generate_xml_tree(xml_directory, files, args.sections_per_file, seed=args.seed)
+                csv_path = os.path.join(directory, f"rewrite-{files}.csv")
+                synthetic.write_rewrite_csv(csv_path, sections)
+
+                first_pass, report = _time_modify(csv_path, xml_directory, workers)
+                second_pass, _ = _time_modify(csv_path, xml_directory, workers)
+                runs.append({
+                    "files": files,
+                    "sections": sections,
+                    "workers": workers,
+                    "sections_added": len(report["added"]),
+                    "insert_pass_seconds": round(first_pass, 3),
+                    "noop_pass_seconds": round(second_pass, 3),
+                    "sections_per_second": round(sections / first_pass, 1),
+                })
+        logging_config.stop_logging()
+    return {"sections_per_file": args.sections_per_file, "runs": runs}
+
+
+def _legacy_parse(content, token_budget):
+    return (utils.extract_title(content), utils.extract_first_paragraph(content),
+            compact.compact_markdown(content, token_budget))
+
+
+def _document_parse(content, token_budget):
+    markdown = document.parse(content)
+    return markdown.title, markdown.first_paragraph, compact.compact_document(markdown, token_budget)
+
+
+def _header_only_parse(content, token_budget):
+    markdown = document.parse(content, header_only=True)
+    return markdown.title, markdown.first_paragraph
+
+
+def _time_parse(parse, contents, token_budget):
+    """CPU seconds for parse over every content, the largest traced allocation peak of one call, and the outputs."""
+    start = time.process_time()
+    outputs = [parse(content, token_budget) for content in contents]
+    cpu_seconds = time.process_time() - start
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for content in contents:
+            tracemalloc.reset_peak()
+            parse(content, token_budget)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    return cpu_seconds, peak, outputs
+
+
+@scenario("parse")
+def bench_parse(args):
+    """Per-file CPU and peak memory of utils.extract_title + utils.extract_first_paragraph + compact.compact_markdown
+    against one document.parse + compact.compact_document, on synthetic pages of increasing size."""
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        # The legacy functions log at INFO on every call, so time them with the run's logging in place.
+        logging_config.setup_logging(log_dir=os.path.join(directory, "logs"), use_queue=True)
+        for mean_chars in args.parse_sizes:
+            print(f"  parse: {args.parse_files} files of ~{mean_chars} characters", file=sys.stderr)
+            paths = synthetic.generate_markdown_tree(os.path.join(directory, f"markdown-{mean_chars}"), args.parse_files,
+                                                     mean_chars=mean_chars, seed=args.seed)
+            contents = [utils.read_markdown_file(path) for path in paths]
+            legacy_cpu, legacy_peak, legacy_outputs = _time_parse(_legacy_parse, contents, args.prompt_token_budget)
+            document_cpu, document_peak, document_outputs = _time_parse(_document_parse, contents,
+                                                                        args.prompt_token_budget)
+            header_cpu, header_peak, _ = _time_parse(_header_only_parse, contents, args.prompt_token_budget)
+            runs.append({
+                "mean_chars": mean_chars,
+                "files": len(contents),
+                "legacy_cpu_ms_per_file": round(legacy_cpu / len(contents) * 1000, 3),
+                "document_cpu_ms_per_file": round(document_cpu / len(contents) * 1000, 3),
+                "header_only_cpu_ms_per_file": round(header_cpu / len(contents) * 1000, 3),
+                "speedup": round(legacy_cpu / document_cpu, 2) if document_cpu else None,
+                "legacy_peak_kib": round(legacy_peak / 1024, 1),
+                "document_peak_kib": round(document_peak / 1024, 1),
+                "header_only_peak_kib": round(header_peak / 1024, 1),
+                "outputs_identical": legacy_outputs == document_outputs,
+            })
+        logging_config.stop_logging()
+    return {"prompt_token_budget": args.prompt_token_budget, "runs": runs}
+
+
+def _int_list(value):
+    return [int(part) for part in value.split(',') if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run offline benchmarks.")
+    parser.add_argument("scenarios", nargs="*", choices=[[]] + sorted(SCENARIOS), help="Scenarios to run (default: all)")
+    parser.add_argument("--files", type=int, default=2000, help="Number of files to simulate")
+    parser.add_argument("--workers", type=int, default=20, help="Number of worker threads")
+    parser.add_argument("--worker-sweep", type=_int_list, default=[1, 5, 10, 20], metavar="N,N,...",
+                        help="MAX_WORKERS values for the generate scenario")
+    parser.add_argument("--file-sweep", type=_int_list, default=[100, 400], metavar="N,N,...",
+                        help="Markdown file counts for the generate scenario")
+    parser.add_argument("--markdown-chars", type=int, default=4000, help="Mean size of a synthetic markdown page")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Median fake Bedrock latency per call")
+    parser.add_argument("--latency-distribution", default="lognormal",
+                        choices=["constant", "uniform", "lognormal", "exponential"])
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of fake Bedrock calls that are throttled")
+    parser.add_argument("--response-chars", type=int, default=0, help="Pad fake abstracts to at least this many characters")
+    parser.add_argument("--chunk-delay-ms", type=float, default=0.0, help="Fake delay between streamed response chunks")
+    parser.add_argument("--streaming", action="store_true", help="Run the generate scenario with STREAMING_ENABLED")
+    parser.add_argument("--hedge-percentile", type=float, default=0,
+                        help="Hedge calls slower than this latency percentile in the generate scenario (0: off)")
+    parser.add_argument("--call-deadline", type=float, default=0, help="Per-call deadline in seconds (0: none)")
+    parser.add_argument("--xml-sweep", type=_int_list, default=[50, 200, 1000], metavar="N,N,...",
+                        help="XML file counts for the modify_xml scenario")
+    parser.add_argument("--sections-per-file", type=int, default=10)
+    parser.add_argument("--xml-workers", type=int, default=os.cpu_count() or 1,
+                        help="Process count compared against a single process in the modify_xml scenario")
+    parser.add_argument("--parse-sizes", type=_int_list, default=[4000, 40000, 400000], metavar="N,N,...",
+                        help="Mean markdown page sizes, in characters, for the parse scenario")
+    parser.add_argument("--parse-files", type=int, default=100, help="Pages per size in the parse scenario")
+    parser.add_argument("--prompt-token-budget", type=int, default=6000,
+                        help="PROMPT_TOKEN_BUDGET for compaction in the parse scenario")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic corpus and fake client")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scenarios": {},
+    }
+    for name in args.scenarios or sorted(SCENARIOS):
+        print(f"Running {name}...", file=sys.stderr)
+        results["scenarios"][name] = SCENARIOS[name](args)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import modify
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """On-disk cache of generated results, keyed by a hash of everything that feeds the prompts.
+
+    Each entry is a small JSON file named after its key, so concurrent workers never
+    contend on a shared index and a crashed run leaves every finished entry usable.
+    """
+
+    def __init__(self, cache_dir, max_entries=5000, max_age_days=30):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content, filename, service_name, model_id, prompt_version):
+        digest = hashlib.sha256()
+        for part in (prompt_version, service_name, model_id, filename, content):
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _is_expired(self, path):
+        return self.max_age_seconds > 0 and time.time() - os.path.getmtime(path) > self.max_age_seconds
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            if self._is_expired(path):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        try:
+            # A lost entry is only a cache miss, so it isn't fsynced.
+            modify.write_atomic(self._entry_path(key), json.dumps(result), fsync=False)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+
+    def evict(self):
+        """Drop expired entries, then the oldest entries beyond max_entries."""
+        entries = []
+        removed = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                mtime = entry.stat().st_mtime
+                if self.max_age_seconds > 0 and time.time() - mtime > self.max_age_seconds:
+                    os.remove(entry.path)
+                    removed += 1
+                else:
+                    entries.append((mtime, entry.path))
+
+        if self.max_entries > 0 and len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                os.remove(path)
+                removed += 1
+
+        if removed:
+            logger.info(f"Evicted {removed} entries from result cache {self.cache_dir}")
+        return removed
+
+    def summary(self):
+        return f"Result cache: {self.hits} hits, {self.misses} misses"
+
+
+def create_cache(config):
+    if not config.get('CACHE_ENABLED', True):
+        logger.info("Result cache disabled.")
+        return None
+
+    return ResultCache(
+        config.get('CACHE_DIR', 'output/cache'),
+        max_entries=config.get('CACHE_MAX_ENTRIES', 5000),
+        max_age_days=config.get('CACHE_MAX_AGE_DAYS', 30)
+    )
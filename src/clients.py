@@ -0,0 +1,163 @@
+import inspect
+import logging
+import threading
+import utils
+
+logger = logging.getLogger(__name__)
+
+# Spare pool slots above the worker count, e.g. for the validation call.
+POOL_HEADROOM = 2
+
+
+class ConnectionStats(logging.Handler):
+    """Counts new, reset and discarded urllib3 connections and the HTTP requests sent.
+
+    Installed on the urllib3.connectionpool logger, whose DEBUG records are the
+    only place urllib3 reports connection churn; requests are counted with a
+    botocore before-send hook on each client.
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.requests = 0
+        self.new_connections = 0
+        self.dropped_connections = 0
+        self.pool_full = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        message = record.msg
+        with self._lock:
+            if message.startswith("Starting new HTTP"):
+                self.new_connections += 1
+            elif message.startswith("Resetting dropped connection"):
+                self.dropped_connections += 1
+            elif message.startswith("Connection pool is full"):
+                self.pool_full += 1
+
+    def count_request(self, **kwargs):
+        with self._lock:
+            self.requests += 1
+
+    def install(self):
+        pool_logger = logging.getLogger("urllib3.connectionpool")
+        pool_logger.addHandler(self)
+        if not pool_logger.isEnabledFor(logging.DEBUG):
+            pool_logger.setLevel(logging.DEBUG)
+
+    def reused_fraction(self):
+        if not self.requests:
+            return 0.0
+        return max(0.0, 1 - (self.new_connections + self.dropped_connections) / self.requests)
+
+    def as_dict(self):
+        return {"requests": self.requests, "new_connections": self.new_connections,
+                "dropped_connections": self.dropped_connections, "pool_full": self.pool_full,
+                "reused_fraction": round(self.reused_fraction(), 3)}
+
+    def summary(self):
+        return (f"Bedrock connections: {self.new_connections} opened and {self.dropped_connections} reset "
+                f"for {self.requests} requests ({self.reused_fraction():.0%} reused), "
+                f"{self.pool_full} discarded because the pool was full")
+
+
+class PerThreadBedrockClient:
+    """Gives every worker thread its own bedrock-runtime client (and connection pool)."""
+
+    def __init__(self, create_client):
+        self._create_client = create_client
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            # boto3 sessions aren't thread-safe, so clients are created one at a time.
+            with self._lock:
+                client = self._create_client()
+            self._local.client = client
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self._client(), name)
+
+
+def is_async_client(client):
+    """True if client.invoke_model is a coroutine function: an async SDK client, or a wrapper around one."""
+    return inspect.iscoroutinefunction(getattr(client, 'invoke_model', None))
+
+
+def stream_error(event):
+    """The ClientError for an error event in a response stream, e.g. {"throttlingException": {"message": ...}}.
+
+    Returns None for a chunk. botocore raises these itself, but other clients
+    (and async SDKs) pass them through as events.
+    """
+    if "chunk" in event:
+        return None
+    from botocore.exceptions import ClientError
+
+    code, detail = next(iter(event.items()), ("UnknownStreamError", {}))
+    message = detail.get("message", "") if isinstance(detail, dict) else str(detail)
+    return ClientError({"Error": {"Code": code, "Message": message}}, "InvokeModelWithResponseStream")
+
+
+async def read_body(body):
+    """Read a response body whose read() may be blocking (botocore) or a coroutine (async SDKs)."""
+    data = body.read()
+    if inspect.isawaitable(data):
+        data = await data
+    return data
+
+
+async def close_stream(stream):
+    """Close a response event stream, awaiting aclose() for async streams."""
+    close = getattr(stream, 'aclose', None) or getattr(stream, 'close', None)
+    if close is not None:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+
+
+def create_bedrock_client(config, max_concurrency):
+    """Build the bedrock-runtime client shared by the generation engine and the validation call.
+
+    Returns (client, stats). The urllib3 pool is sized for max_concurrency workers
+    with TCP keep-alive and explicit timeouts. BEDROCK_CLIENT_MODE "shared" (the
+    default) uses one client for every worker; "per_thread" gives each worker
+    thread its own. stats is a ConnectionStats, or None for a BEDROCK_CLIENT_FACTORY client.
+    """
+    if config.get('BEDROCK_CLIENT_FACTORY'):
+        return utils.initialize_bedrock(config['BEDROCK_CLIENT_FACTORY']), None
+
+    from botocore.config import Config
+
+    mode = config.get('BEDROCK_CLIENT_MODE', 'shared')
+    if mode not in ('shared', 'per_thread'):
+        raise ValueError(f"Invalid BEDROCK_CLIENT_MODE '{mode}', expected 'shared' or 'per_thread'")
+    pool_size = max_concurrency + POOL_HEADROOM if mode == 'shared' else 1 + POOL_HEADROOM
+    client_options = {}
+    if config.get('RATE_LIMIT_ENABLED', True):
+        # ThrottledBedrockClient retries throttles itself and its RateController has to see every one,
+        # so botocore makes a single attempt instead of retrying them silently.
+        client_options['retries'] = {'total_max_attempts': 1, 'mode': 'standard'}
+    client_config = Config(
+        max_pool_connections=pool_size,
+        tcp_keepalive=True,
+        connect_timeout=config.get('BEDROCK_CONNECT_TIMEOUT', 5),
+        read_timeout=config.get('BEDROCK_READ_TIMEOUT', 120),
+        **client_options
+    )
+
+    stats = ConnectionStats()
+    stats.install()
+
+    def create_client():
+        client = utils.get_boto3_session().client(service_name="bedrock-runtime", config=client_config)
+        client.meta.events.register('before-send.bedrock-runtime', stats.count_request)
+        return client
+
+    logger.info(f"Creating {mode} Bedrock client with a pool of {pool_size} connections")
+    if mode == 'per_thread':
+        return PerThreadBedrockClient(create_client), stats
+    return create_client(), stats
@@ -0,0 +1,114 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+FENCE_PATTERN = re.compile(r'^\s*(```|~~~)\s*([\w+-]*)')
+
+
+def estimate_tokens(text):
+    """Offline token estimate for text, or for a length in characters.
+
+    ~4 characters per token is close for English prose and markdown.
+    """
+    length = text if isinstance(text, int) else len(text)
+    return (length + 3) // 4
+
+
+def compact_markdown(content, token_budget):
+    """Shrink markdown for a prompt while keeping the headings and prose the model summarizes.
+
+    - drops the dashed metadata header at the top of the markdown build output
+    - replaces fenced code blocks with a one-line placeholder naming the language
+    - keeps the header row of tables and replaces the remaining rows with a placeholder
+    - truncates to fit token_budget, preferring a line boundary
+
+    Returns (compacted_content, tokens_saved).
+    """
+    lines = content.split('\n')
+    output = []
+    i = 0
+
+    # Same dashed header that utils.extract_first_paragraph skips (document.parse finds it as body_start).
+    if lines and lines[0].strip().startswith('--------'):
+        i = 1
+        while i < len(lines) and not lines[i].strip().startswith('--------'):
+            i += 1
+        i += 1
+
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+
+        fence = FENCE_PATTERN.match(line)
+        if fence:
+            marker, language = fence.group(1), fence.group(2)
+            start = i
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(marker):
+                i += 1
+            omitted = i - start - 1
+            output.append(f"[{language + ' ' if language else ''}code block, {omitted} lines omitted]")
+            i += 1
+            continue
+
+        if stripped.startswith('|'):
+            output.append(line)
+            start = i
+            i += 1
+            while i < len(lines) and lines[i].strip().startswith('|'):
+                i += 1
+            # The second table line is the |---| separator, not a data row.
+            rows = max(0, i - start - 2)
+            if rows:
+                output.append(f"[table, {rows} rows omitted]")
+            continue
+
+        output.append(line)
+        i += 1
+
+    compacted = truncate('\n'.join(output), token_budget)
+    return compacted, max(0, estimate_tokens(content) - estimate_tokens(compacted))
+
+
+def compact_document(document, token_budget):
+    """compact_markdown for a parsed document.MarkdownDocument, built from its spans without re-scanning the text.
+
+    Returns the same (compacted_content, tokens_saved) as compact_markdown(document.content, token_budget).
+    """
+    if not document.complete:
+        raise ValueError("compact_document needs a fully parsed document, not a header-only one")
+
+    content = document.content
+    spans = sorted(
+        [(start, end, f"[{language + ' ' if language else ''}code block, {omitted} lines omitted]")
+         for start, end, language, omitted in document.code_spans] +
+        [(start, end, f"[table, {rows} rows omitted]" if rows else None)
+         for start, end, rows in document.table_spans])
+
+    pieces = []
+    position = document.body_start
+    for start, end, placeholder in spans:
+        # Spans start at a line start, so the kept lines before them end at start - 1.
+        if start > position:
+            pieces.append(content[position:start - 1])
+        if placeholder:
+            pieces.append(placeholder)
+        position = end + 1
+    if position <= len(content):
+        pieces.append(content[position:])
+
+    compacted = truncate('\n'.join(pieces), token_budget)
+    return compacted, max(0, estimate_tokens(content) - estimate_tokens(compacted))
+
+
+def truncate(compacted, token_budget):
+    """Cut compacted to fit token_budget, preferring a line boundary."""
+    max_chars = token_budget * 4
+    if token_budget and len(compacted) > max_chars:
+        cut = compacted.rfind('\n', 0, max_chars)
+        if cut < max_chars // 2:
+            # A very long line; cut it on a word boundary rather than dropping it.
+            cut = compacted.rfind(' ', 0, max_chars)
+        compacted = compacted[:cut if cut > 0 else max_chars] + "\n[content truncated]"
+    return compacted
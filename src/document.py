@@ -0,0 +1,131 @@
+import re
+
+# The first h1 anywhere in the file, as utils.extract_title finds it.
+TITLE_PATTERN = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+ANCHOR_PATTERN = re.compile(r'<a\s+[^>]*>|</a>')
+# The dashed metadata block at the top of the markdown build output.
+DASHED_LINE_PATTERN = re.compile(r'^[^\S\n]*--------', re.MULTILINE)
+# A line that starts a paragraph: not blank, not bold (**) and not a heading.
+PARAGRAPH_LINE_PATTERN = re.compile(r'^[^\S\n]*(?=\S)(?!\*\*|#)([^\n]*)', re.MULTILINE)
+# A line that starts a code fence, a table or a heading. [^\S\n] keeps the match on one line.
+BLOCK_LINE_PATTERN = re.compile(
+    r'[^\S\n]*(?:(?P<fence>```|~~~)[^\S\n]*(?P<language>[\w+-]*)|(?P<table>\|))'
+    r'|(?P<level>#{1,6})[^\S\n]+(?P<heading>[^\n]+)')
+# The newline before the next such line. Searching for a literal newline is much faster than a
+# MULTILINE ^, which the re module tries at every character.
+NEXT_BLOCK_PATTERN = re.compile(r'\n(?=[^\S\n]*(?:```|~~~|\|)|#{1,6}[^\S\n]+[^\n])')
+FENCE_CLOSE_PATTERNS = {marker: re.compile(r'\n[^\S\n]*' + re.escape(marker)) for marker in ('```', '~~~')}
+# The table rows following a table line.
+TABLE_ROWS_PATTERN = re.compile(r'(?:\n[^\S\n]*\|[^\n]*)*')
+
+
+class MarkdownDocument:
+    """One markdown file, parsed in a single pass into what the pipeline needs from it.
+
+    Spans are character offsets into content: code_spans hold
+    (start, end, language, lines omitted) for each fenced block including its
+    fence lines, table_spans hold (start, end, data rows) for each table
+    below its header row, and body_start is where the content after the
+    dashed metadata header begins. end is the offset of the span's last
+    newline (or len(content)). A header-only document has no outline or spans.
+    """
+
+    __slots__ = ('content', 'size', 'title', 'first_paragraph', 'body_start',
+                 'headings', 'code_spans', 'table_spans', 'complete')
+
+    def __init__(self, content, size, title, first_paragraph, body_start, headings, code_spans, table_spans, complete):
+        self.content = content
+        self.size = size
+        self.title = title
+        self.first_paragraph = first_paragraph
+        self.body_start = body_start
+        self.headings = headings
+        self.code_spans = code_spans
+        self.table_spans = table_spans
+        self.complete = complete
+
+
+def _line_end(content, position):
+    end = content.find('\n', position)
+    return len(content) if end == -1 else end
+
+
+def _find_body_start(content):
+    """Offset of the first line after the dashed header, 0 without one, or past the end if it never closes."""
+    first_line_end = _line_end(content, 0)
+    if not content[:first_line_end].strip().startswith('--------'):
+        return 0
+    closing = DASHED_LINE_PATTERN.search(content, first_line_end + 1) if first_line_end < len(content) else None
+    if closing is None:
+        return len(content) + 1
+    return _line_end(content, closing.start()) + 1
+
+
+def _next_block(content, position):
+    """The first block-starting line at or after position, which is a line start."""
+    match = BLOCK_LINE_PATTERN.match(content, position)
+    if match:
+        return match
+    newline = NEXT_BLOCK_PATTERN.search(content, position)
+    return BLOCK_LINE_PATTERN.match(content, newline.start() + 1) if newline else None
+
+
+def _scan_blocks(content, body_start):
+    """Heading outline, code spans and table spans of the body, in one scan of its block-starting lines."""
+    headings = []
+    code_spans = []
+    table_spans = []
+    position = body_start
+    while position <= len(content):
+        match = _next_block(content, position)
+        if match is None:
+            break
+        line_start = match.start()
+        line_end = _line_end(content, line_start)
+
+        if match.group('fence'):
+            closing = FENCE_CLOSE_PATTERNS[match.group('fence')].search(content, line_end)
+            if closing is None:
+                # An unclosed fence runs to the end of the file.
+                code_spans.append((line_start, len(content), match.group('language'), content.count('\n', line_start)))
+                break
+            end = _line_end(content, closing.start() + 1)
+            code_spans.append((line_start, end, match.group('language'),
+                               content.count('\n', line_start, closing.start())))
+            position = end + 1
+        elif match.group('table'):
+            following = TABLE_ROWS_PATTERN.match(content, line_end)
+            end = following.end()
+            rows = following.group().count('\n')
+            # The header row stays; the |---| separator and the data rows form the span.
+            if rows:
+                table_spans.append((line_end + 1, end, rows - 1))
+            position = end + 1
+        else:
+            headings.append((len(match.group('level')), ANCHOR_PATTERN.sub('', match.group('heading')).strip()))
+            position = line_end + 1
+    return headings, code_spans, table_spans
+
+
+def parse(content, size=None, header_only=False):
+    """Build a MarkdownDocument from content.
+
+    The title and first paragraph are the same as utils.extract_title and
+    utils.extract_first_paragraph give; both searches stop at their first
+    match. With header_only, the rest of the body isn't scanned. size is the
+    file's size in bytes, computed from content if not given.
+    """
+    title_match = TITLE_PATTERN.search(content)
+    title = ANCHOR_PATTERN.sub('', title_match.group(1)).strip() if title_match else ""
+
+    body_start = _find_body_start(content)
+    paragraph_match = PARAGRAPH_LINE_PATTERN.search(content, body_start) if body_start <= len(content) else None
+    first_paragraph = paragraph_match.group(1).strip() if paragraph_match else ""
+
+    if size is None:
+        size = len(content.encode('utf-8'))
+    if header_only:
+        return MarkdownDocument(content, size, title, first_paragraph, body_start, (), (), (), False)
+    headings, code_spans, table_spans = _scan_blocks(content, body_start)
+    return MarkdownDocument(content, size, title, first_paragraph, body_start, headings, code_spans, table_spans, True)
+
@@ -0,0 +1,51 @@
+import json
+import logging
+import os
+import time
+import modify
+
+logger = logging.getLogger(__name__)
+
+
+class EnvironmentCheckCache:
+    """Remembers successful environment checks (AWS identity, Bedrock access) in a JSON file.
+
+    A stored check is trusted for ttl_seconds, so repeated runs skip the STS call
+    and the paid Bedrock validation request. Failed checks are never stored.
+    """
+
+    def __init__(self, path, ttl_seconds=3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable environment check cache {path}: {e}")
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry and time.time() - entry['checked'] < self.ttl_seconds:
+            return entry['value']
+        return None
+
+    def put(self, key, value=True):
+        self.entries[key] = {'checked': time.time(), 'value': value}
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Shards started together all write this file; each replaces it whole.
+            modify.write_atomic(self.path, json.dumps(self.entries))
+        except OSError as e:
+            # Only costs a repeated check on the next run.
+            logger.warning(f"Failed to write environment check cache {self.path}: {e}")
+
+
+def create_check_cache(config):
+    if not config.get('ENV_CHECK_CACHE_ENABLED', True):
+        return None
+    return EnvironmentCheckCache(config.get('ENV_CHECK_CACHE_FILE', 'output/env-check-cache.json'),
+                                 config.get('ENV_CHECK_CACHE_TTL_SECONDS', 3600))
@@ -0,0 +1,288 @@
+import asyncio
+import io
+import json
+import random
+import re
+import threading
+import time
+from botocore.exceptions import ClientError
+from config import get_config
+
+STREAM_CHUNK_CHARS = 16
+# Bedrock keeps a cached prompt prefix for five minutes after its last use.
+PROMPT_CACHE_TTL_SECONDS = 300
+
+
+class FakeBedrockClient:
+    """Local stand-in for the bedrock-runtime client, for running the pipeline without AWS.
+
+    Answers every prompt this tool sends (abstract, title, fused and batch) with
+    deterministic text derived from the filename and original title in the prompt.
+    For benchmarks it can also simulate latency (constant, uniform, lognormal or
+    exponential around latency_ms), ThrottlingException errors at throttle_rate,
+    and abstracts padded to response_chars. System blocks marked with cache_control
+    are treated as a prompt cache: the first request writes the prefix and later
+    ones within PROMPT_CACHE_TTL_SECONDS read it, as reported in the usage.
+    Prefixes under cache_min_tokens aren't cached, as on Bedrock.
+    """
+
+    def __init__(self, latency_ms=0.0, latency_distribution="lognormal", latency_sigma=0.5,
+                 throttle_rate=0.0, response_chars=0, chunk_delay_ms=0.0, cache_min_tokens=1024, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.throttle_rate = throttle_rate
+        self.response_chars = response_chars
+        self.chunk_delay_ms = chunk_delay_ms
+        self.cache_min_tokens = cache_min_tokens
+        self._prompt_cache = {}
+        self.calls = 0
+        self.throttles = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self):
+        """Seconds for one call, drawn from the configured distribution with median (or mean) latency_ms."""
+        if not self.latency_ms:
+            return 0.0
+        with self._lock:
+            if self.latency_distribution == "constant":
+                ms = self.latency_ms
+            elif self.latency_distribution == "uniform":
+                ms = self._rng.uniform(0, 2 * self.latency_ms)
+            elif self.latency_distribution == "exponential":
+                ms = self._rng.expovariate(1 / self.latency_ms)
+            elif self.latency_distribution == "lognormal":
+                ms = self.latency_ms * self._rng.lognormvariate(0, self.latency_sigma)
+            else:
+                raise ValueError(f"Unknown latency distribution '{self.latency_distribution}'")
+        return ms / 1000
+
+    def _start_call(self):
+        with self._lock:
+            self.calls += 1
+            throttled = self._rng.random() < self.throttle_rate
+            if throttled:
+                self.throttles += 1
+            else:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if throttled:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeModel")
+
+    def _end_call(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _cache_usage(self, request):
+        """Token counts for the cacheable prefix: the system blocks up to the last cache_control marker."""
+        system = request.get('system')
+        if not isinstance(system, list):
+            return 0, {}
+        marked = [i for i, block in enumerate(system) if 'cache_control' in block]
+        if not marked:
+            return 0, {}
+        prefix = ''.join(block['text'] for block in system[:marked[-1] + 1])
+        tokens = len(prefix) // 4
+        if tokens < self.cache_min_tokens:
+            return 0, {}
+
+        now = time.monotonic()
+        with self._lock:
+            hit = self._prompt_cache.get(prefix, 0) > now
+            self._prompt_cache[prefix] = now + PROMPT_CACHE_TTL_SECONDS
+        key = "cache_read_input_tokens" if hit else "cache_creation_input_tokens"
+        return len(prefix), {key: tokens}
+
+    def _complete(self, body):
+        request = json.loads(body)
+        content = request['messages'][-1]['content']
+        prompt = content if isinstance(content, str) else ''.join(block.get('text', '') for block in content)
+        text = fake_completion(prompt, self.response_chars)
+        stop_reason = "end_turn"
+        for stop_sequence in request.get('stop_sequences', []):
+            if stop_sequence in text:
+                text = text[:text.index(stop_sequence)]
+                stop_reason = "stop_sequence"
+        max_chars = request.get('max_tokens', 256) * 4
+        if len(text) > max_chars:
+            text, stop_reason = text[:max_chars], "max_tokens"
+        cached_chars, cache_usage = self._cache_usage(request)
+        usage = {"input_tokens": (len(body) - cached_chars) // 4, "output_tokens": len(text) // 4 + 1, **cache_usage}
+        return text, stop_reason, usage
+
+    def _response_seconds(self, text):
+        # The whole response is returned at once, after the time streaming it would have taken.
+        chunks = max(1, -(-len(text) // STREAM_CHUNK_CHARS))
+        return self.sample_latency() + (chunks - 1) * self.chunk_delay_ms / 1000
+
+    def invoke_model(self, body, modelId, **kwargs):
+        self._start_call()
+        try:
+            text, stop_reason, usage = self._complete(body)
+            time.sleep(self._response_seconds(text))
+        finally:
+            self._end_call()
+        return {
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "body": io.BytesIO(response_bytes(text, stop_reason, usage))
+        }
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        """Streaming variant: the body yields Anthropic message events as {"chunk": {"bytes": ...}}.
+
+        The sampled latency is spent before the first chunk, and chunk_delay_ms
+        between chunks, so a caller that stops reading early saves the rest.
+        """
+        self._start_call()
+        try:
+            text, stop_reason, usage = self._complete(body)
+        except Exception:
+            self._end_call()
+            raise
+        return {
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "body": self._stream_events(text, stop_reason, usage)
+        }
+
+    def _timed_events(self, text, stop_reason, usage):
+        """(seconds to wait, event) pairs for a streamed response."""
+        def event(payload):
+            return {"chunk": {"bytes": json.dumps(payload).encode('utf-8')}}
+
+        yield self.sample_latency(), event({"type": "message_start", "message": {
+            "role": "assistant", "content": [], "usage": {**usage, "output_tokens": 0}}})
+        yield 0, event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for start in range(0, len(text), STREAM_CHUNK_CHARS):
+            yield (self.chunk_delay_ms / 1000 if start else 0), event({
+                "type": "content_block_delta", "index": 0,
+                "delta": {"type": "text_delta", "text": text[start:start + STREAM_CHUNK_CHARS]}})
+        yield 0, event({"type": "content_block_stop", "index": 0})
+        yield 0, event({"type": "message_delta", "delta": {"stop_reason": stop_reason},
+                        "usage": {"output_tokens": usage["output_tokens"]}})
+        yield 0, event({"type": "message_stop"})
+
+    def _stream_events(self, text, stop_reason, usage):
+        try:
+            for seconds, event in self._timed_events(text, stop_reason, usage):
+                if seconds:
+                    time.sleep(seconds)
+                yield event
+        finally:
+            self._end_call()
+
+
+class AsyncStreamingBody:
+    """A response body whose read() is a coroutine, as async SDK clients return."""
+
+    def __init__(self, data):
+        self._data = data
+
+    async def read(self):
+        return self._data
+
+
+class AsyncFakeBedrockClient(FakeBedrockClient):
+    """FakeBedrockClient with coroutine methods, shaped like an async SDK client.
+
+    Bodies are read with `await body.read()` and event streams with `async for`.
+    Latency is spent in asyncio.sleep, so any number of calls run on the event
+    loop without threads.
+    """
+
+    async def invoke_model(self, body, modelId, **kwargs):
+        self._start_call()
+        try:
+            text, stop_reason, usage = self._complete(body)
+            await asyncio.sleep(self._response_seconds(text))
+        finally:
+            self._end_call()
+        return {
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "body": AsyncStreamingBody(response_bytes(text, stop_reason, usage))
+        }
+
+    async def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        self._start_call()
+        try:
+            text, stop_reason, usage = self._complete(body)
+        except Exception:
+            self._end_call()
+            raise
+        return {
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "body": self._stream_events_async(text, stop_reason, usage)
+        }
+
+    async def _stream_events_async(self, text, stop_reason, usage):
+        try:
+            for seconds, event in self._timed_events(text, stop_reason, usage):
+                if seconds:
+                    await asyncio.sleep(seconds)
+                yield event
+        finally:
+            self._end_call()
+
+
+def response_bytes(text, stop_reason, usage):
+    return json.dumps({
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": stop_reason,
+        "usage": usage
+    }).encode('utf-8')
+
+
+def fake_completion(prompt, response_chars=0):
+    batch_filenames = re.findall(r'<document filename="([^"]+)"', prompt)
+    if batch_filenames:
+        return json.dumps({filename: {"abstract": _fake_abstract(filename, response_chars), "title": _fake_title(filename)}
+                           for filename in batch_filenames})
+
+    filename_match = re.search(r'Filename: (\S+)', prompt)
+    filename = filename_match.group(1) if filename_match else "section"
+    title_match = re.search(r'Original Title: (.*)', prompt)
+    original_title = title_match.group(1).strip() if title_match else filename
+
+    if '"abstract" and "title"' in prompt:
+        return json.dumps({"abstract": _fake_abstract(filename, response_chars), "title": _fake_title(original_title)})
+    if prompt.startswith("Create a concise abstract"):
+        return _fake_abstract(filename, response_chars)
+    return _fake_title(original_title)
+
+
+def _fake_abstract(filename, response_chars=0):
+    abstract = f"Learn how to use {filename} to get work done."
+    while len(abstract) < response_chars:
+        abstract += " Use it to get more work done."
+    return abstract
+
+
+def _fake_title(original_title):
+    return f"Use {original_title}"
+
+
+def create_client():
+    """Factory for BEDROCK_CLIENT_FACTORY: "fake_bedrock:create_client".
+
+    Reads the optional FAKE_BEDROCK_* settings from the loaded config.
+    """
+    return FakeBedrockClient(**_client_options(get_config()))
+
+
+def create_async_client():
+    """Factory for BEDROCK_CLIENT_FACTORY: "fake_bedrock:create_async_client", for ENGINE: async."""
+    return AsyncFakeBedrockClient(**_client_options(get_config()))
+
+
+def _client_options(config):
+    return dict(
+        latency_ms=config.get('FAKE_BEDROCK_LATENCY_MS', 0.0),
+        latency_distribution=config.get('FAKE_BEDROCK_LATENCY_DISTRIBUTION', 'lognormal'),
+        throttle_rate=config.get('FAKE_BEDROCK_THROTTLE_RATE', 0.0),
+        response_chars=config.get('FAKE_BEDROCK_RESPONSE_CHARS', 0),
+        chunk_delay_ms=config.get('FAKE_BEDROCK_CHUNK_DELAY_MS', 0.0),
+        cache_min_tokens=config.get('FAKE_BEDROCK_CACHE_MIN_TOKENS', 1024),
+        seed=config.get('FAKE_BEDROCK_SEED')
+    )
@@ -1,72 +1,325 @@
 import logging
 from config import get_config
-import utils, prompts
+import utils, prompts, compact, document, hedging, jobs, shard as sharding
+from cache import ResultCache
+from metrics import get_run_metrics
 import os
+import itertools
+import time
 import concurrent.futures
 from tqdm.auto import tqdm
 
 
-def process_single_file(file_path, bedrock_client):
-    logger = logging.getLogger(f"FileProcessor-{os.path.basename(file_path)}")
+def build_result(filename, existing_title, abstract, new_title, first_paragraph):
+    return {
+        "File Name": filename,
+        "Existing Title": existing_title,
+        "Existing Title Length": len(existing_title),
+        "AI Generated Abstract": abstract,
+        "AI Generated Title": new_title,
+        "AI Generated Title Length": len(new_title),
+        "First Paragraph": first_paragraph
+    }
+
+
+def make_cache_key(content, filename, config=None):
+    config = config or get_config()
+    return ResultCache.make_key(content, filename, config['SERVICE_NAME'],
+                                config['BEDROCK_MODEL'], prompts.prompt_version(config))
+
+
+def parse_document(content, file_path, config=None):
+    """Parse a file's content once for its title and first paragraph, plus its code and table spans when compacting."""
+    config = config or get_config()
+    return document.parse(content, os.path.getsize(file_path),
+                          header_only=not config.get('COMPACTION_ENABLED', True))
+
+
+def prepare_prompt_content(markdown, filename, config=None):
+    config = config or get_config()
+    if not config.get('COMPACTION_ENABLED', True):
+        return markdown.content
+
+    compacted, tokens_saved = compact.compact_document(markdown, config.get('PROMPT_TOKEN_BUDGET', 6000))
+    get_run_metrics().increment("compaction_tokens_saved", tokens_saved)
+    logging.LoggerAdapter(logging.getLogger("FileProcessor"), {"doc": filename}).info(
+        f"Compacted {filename} for the prompt, saving ~{tokens_saved} of ~{compact.estimate_tokens(markdown.content)} tokens")
+    return compacted
+
+
+def file_logger(file_path):
+    return logging.LoggerAdapter(logging.getLogger("FileProcessor"), {"doc": os.path.basename(file_path)})
+
+
+def read_for_processing(file_path, result_cache, config, logger):
+    """Read a file and look it up in the result cache. Returns (content, cache_key, cached result or None)."""
+    with get_run_metrics().stage("read"):
+        content = utils.read_markdown_file(file_path)
+
+    cache_key = None
+    if result_cache is not None:
+        cache_key = make_cache_key(content, os.path.basename(file_path), config)
+        cached = result_cache.get(cache_key)
+        if cached:
+            logger.info(f"Using cached result for file: {file_path}")
+            return content, cache_key, cached
+    return content, cache_key, None
+
+
+def parse_for_prompt(content, file_path, config, logger):
+    """Parse a file's content; returns (document, the content to put in its prompt)."""
+    filename = os.path.basename(file_path)
+    with get_run_metrics().stage("parse"):
+        markdown = parse_document(content, file_path, config)
+    logger.info(f"Parsed {filename} ({markdown.size} bytes), title: {markdown.title}")
+    return markdown, prepare_prompt_content(markdown, filename, config)
+
+
+def finish_file(file_path, markdown, abstract, new_title, start, result_cache, cache_key, logger):
+    """Record a processed file and build (and cache) its result."""
+    filename = os.path.basename(file_path)
+    logger.info(f"Completed processing file: {file_path}")
+    get_run_metrics().record_file(filename, time.perf_counter() - start)
+    result = build_result(filename, markdown.title, abstract, new_title, markdown.first_paragraph)
+    if cache_key is not None and abstract and new_title:
+        result_cache.put(cache_key, result)
+    return result
+
+
+def file_failed(file_path, error, logger):
+    logger.error(f"Error processing file {file_path}: {str(error)}")
+    get_run_metrics().increment("files_failed")
+    return None
+
+
+def process_single_file(file_path, bedrock_client, result_cache=None, config=None):
+    config = config or get_config()
+    logger = file_logger(file_path)
     logger.info(f"Processing file: {file_path}")
 
     try:
-        filename = os.path.basename(file_path)
+        start = time.perf_counter()
+        content, cache_key, cached = read_for_processing(file_path, result_cache, config, logger)
+        if cached:
+            return cached
 
-        content = utils.read_markdown_file(file_path)
-        existing_title = utils.extract_title(content)
-        existing_title_length = len(existing_title)
-        abstract = prompts.generate_abstract(bedrock_client, content, filename)
-        new_title = prompts.generate_new_title(bedrock_client, existing_title, abstract, filename)
-        new_title_length = len(new_title)
-        first_paragraph = utils.extract_first_paragraph(content)
-
-        logger.info(f"Completed processing file: {file_path}")
-        return {
-            "File Name": filename,
-            "Existing Title": existing_title,
-            "Existing Title Length": existing_title_length,
-            "AI Generated Abstract": abstract,
-            "AI Generated Title": new_title,
-            "AI Generated Title Length": new_title_length,
-            "First Paragraph": first_paragraph
-        }
+        markdown, prompt_content = parse_for_prompt(content, file_path, config, logger)
+        with hedging.file_deadline(config.get('FILE_DEADLINE_SECONDS', 0)):
+            abstract, new_title = prompts.generate_abstract_and_title(
+                bedrock_client, prompt_content, markdown.title, os.path.basename(file_path), config)
+        return finish_file(file_path, markdown, abstract, new_title, start, result_cache, cache_key, logger)
     except Exception as e:
-        logger.error(f"Error processing file {file_path}: {str(e)}")
-        return None
+        return file_failed(file_path, e, logger)
 
 
-def process_markdown_files(directory, bedrock_client):
-    config = get_config()
-    logger = logging.getLogger("MarkdownProcessor")
-    logger.info(f"Processing markdown files in directory: {directory}")
+def process_batch(file_paths, bedrock_client, result_cache=None, config=None):
+    """Generate results for several small files with one Bedrock request.
+
+    Files missing from the model's response, or with malformed entries, are
+    re-run through process_single_file. Each file's time is counted from the
+    start of the batch, and FILE_DEADLINE_SECONDS bounds the batch request.
+    """
+    config = config or get_config()
+    logger = logging.getLogger("BatchProcessor")
+    start = time.perf_counter()
     results = []
+    pending = {}
+    fallback_paths = []
 
-    try:
-        markdown_files = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".md")]
-        total_files = min(len(markdown_files), config['MAX_FILES'])
+    for file_path in file_paths:
+        file_log = file_logger(file_path)
+        try:
+            content, cache_key, cached = read_for_processing(file_path, result_cache, config, file_log)
+            if cached:
+                results.append(cached)
+                continue
+            with get_run_metrics().stage("parse"):
+                markdown = parse_document(content, file_path, config)
+        except Exception as e:
+            results.append(file_failed(file_path, e, file_log))
+            continue
+        pending[os.path.basename(file_path)] = (file_path, markdown, cache_key)
+
+    generated = {}
+    if len(pending) > 1:
+        try:
+            # One deadline for the request that all of the batch's files wait on.
+            with hedging.file_deadline(config.get('FILE_DEADLINE_SECONDS', 0)):
+                generated = prompts.generate_batch(
+                    bedrock_client,
+                    [(filename, markdown.title, prepare_prompt_content(markdown, filename, config))
+                     for filename, (_, markdown, _) in pending.items()],
+                    config
+                )
+        except Exception as e:
+            logger.warning(f"Batch request failed, falling back to single-file processing: {str(e)}")
+
+    for filename, (file_path, markdown, cache_key) in pending.items():
+        entry = generated.get(filename)
+        if entry is None:
+            fallback_paths.append((file_path, cache_key))
+            continue
+        results.append(finish_file(file_path, markdown, entry["abstract"], entry["title"], start, result_cache,
+                                   cache_key, file_logger(file_path)))
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=config['MAX_WORKERS']) as executor:
-            future_to_file = {executor.submit(process_single_file, file_path, bedrock_client): file_path
-                              for file_path in markdown_files[:total_files]}
+    if fallback_paths:
+        logger.info(f"Falling back to single-file processing for {len(fallback_paths)} files.")
+    for file_path, cache_key in fallback_paths:
+        # The cache was already consulted above, so only store the fallback result.
+        result = process_single_file(file_path, bedrock_client, config=config)
+        if result and cache_key is not None and result["AI Generated Abstract"] and result["AI Generated Title"]:
+            result_cache.put(cache_key, result)
+        results.append(result)
 
-            with tqdm(total=total_files, desc="Processing files") as pbar:
-                for future in concurrent.futures.as_completed(future_to_file):
-                    file_path = future_to_file[future]
+    return results
+
+
+def process_file_group(file_paths, bedrock_client, result_cache=None, config=None):
+    if len(file_paths) == 1:
+        return [process_single_file(file_paths[0], bedrock_client, result_cache, config)]
+    return process_batch(file_paths, bedrock_client, result_cache, config)
+
+
+def plan_batches(file_paths, token_budget, max_files):
+    """Greedily pack files into groups of at most token_budget estimated tokens and max_files files.
+
+    Files larger than half the budget gain little from batching and are kept on
+    their own so one large page can't crowd out a whole batch. Yields each group
+    as soon as it is full, so file_paths may be a lazy iterator.
+    """
+    current = []
+    current_tokens = 0
+    for file_path in file_paths:
+        # The file size stands in for its length, so files aren't read just to plan batches.
+        tokens = compact.estimate_tokens(os.path.getsize(file_path))
+        if tokens > token_budget // 2:
+            yield [file_path]
+            continue
+        if current and (current_tokens + tokens > token_budget or len(current) >= max_files):
+            yield current
+            current = []
+            current_tokens = 0
+        current.append(file_path)
+        current_tokens += tokens
+    if current:
+        yield current
+
+
+def _discover_markdown_files(directory, config):
+    return utils.discover_markdown_files(
+        directory,
+        include=config.get('MARKDOWN_INCLUDE', ['*.md']),
+        exclude=config.get('MARKDOWN_EXCLUDE', []),
+        recursive=config.get('MARKDOWN_RECURSIVE', True)
+    )
+
+
+def check_file_names(directory, config=None):
+    """Raise ValueError if two markdown files under directory have the same name.
+
+    The engines call this before starting any work, so a duplicate can't stop a
+    run part way through. Only a recursive search can find two, so only then is
+    the tree listed for it.
+    """
+    config = config or get_config()
+    if config.get('MARKDOWN_RECURSIVE', True):
+        for _ in utils.unique_file_names(_discover_markdown_files(directory, config), directory):
+            pass
+
+
+def iter_markdown_files(directory, completed=None, shard=None, config=None):
+    """Yield up to MAX_FILES markdown files to process.
+
+    Discovery is lazy, so work starts before a large tree has been listed, unless
+    FILE_ORDER is "largest_first", which needs the full listing to sort by size.
+    Files whose name is in `completed` are skipped, and with shard=(index, count)
+    only the files hashed to that shard are kept. Names are checked for
+    duplicates beforehand with check_file_names.
+    """
+    config = config or get_config()
+    markdown_files = _discover_markdown_files(directory, config)
+    if shard:
+        markdown_files = (f for f in markdown_files if sharding.in_shard(f, shard))
+    if completed:
+        logging.getLogger("MarkdownProcessor").info(f"Skipping {len(completed)} files already completed.")
+        markdown_files = (f for f in markdown_files if os.path.basename(f) not in completed)
+    if config.get('FILE_ORDER', 'directory') == 'largest_first':
+        # Start the slowest documents first so they don't stretch out the end of the run.
+        markdown_files = sorted(markdown_files, key=os.path.getsize, reverse=True)
+    return itertools.islice(markdown_files, config['MAX_FILES'])
+
+
+def iter_file_groups(directory, completed=None, shard=None, config=None):
+    """Lists of files to process together: batches with BATCH_MODE_ENABLED, otherwise one file each."""
+    config = config or get_config()
+    markdown_files = iter_markdown_files(directory, completed, shard, config)
+    if config.get('BATCH_MODE_ENABLED', False):
+        return plan_batches(markdown_files, config.get('BATCH_TOKEN_BUDGET', 8000), config.get('BATCH_MAX_FILES', 10))
+    return ([file_path] for file_path in markdown_files)
+
+
+def process_jobs(job_list, bedrock_client, max_workers):
+    """Process the markdown files of every jobs.Job on one pool of max_workers threads.
+
+    Work is submitted from each job in turn, so jobs share the pool (and the
+    client's rate budget) evenly. Each job's results go to its journal, or to
+    job.results without one.
+    """
+    logger = logging.getLogger("MarkdownProcessor")
+    for job in job_list:
+        check_file_names(job.directory, job.config)
+    for job in job_list:
+        logger.info(f"Processing markdown files in directory: {job.directory}")
+    file_groups = jobs.tag_groups(
+        job_list, lambda job: iter_file_groups(job.directory, job.completed, job.shard, job.config))
+
+    # Only keep ~2x max_workers tasks queued; the rest are submitted as others complete.
+    window = 2 * max_workers
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_group = {}
+
+        def submit_next(count):
+            for job, file_paths in itertools.islice(file_groups, count):
+                future = executor.submit(process_file_group, file_paths, bedrock_client, job.result_cache, job.config)
+                future_to_group[future] = (job, file_paths)
+
+        submit_next(window)
+        with tqdm(desc="Processing files", unit="file") as pbar:
+            while future_to_group:
+                done, _ = concurrent.futures.wait(future_to_group, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job, file_paths = future_to_group.pop(future)
                     try:
-                        result = future.result()
-                        if result:
-                            results.append(result)
+                        for result in future.result():
+                            job.record(result)
+                            if result:
+                                get_run_metrics().increment("files_processed")
                     except Exception as exc:
-                        logger.error(f'{file_path} generated an exception: {exc}')
+                        logger.error(f'{", ".join(file_paths)} generated an exception: {exc}')
+                        job.failed += len(file_paths)
                     finally:
-                        pbar.update(1)
+                        pbar.update(len(file_paths))
+                submit_next(window - len(future_to_group))
 
-        logger.info(f"Processed {len(results)} markdown files.")
-        return results
-    except Exception as e:
-        logger.error(f"Error in process_markdown_files: {str(e)}")
-        return []
+    for job in job_list:
+        logger.info(f"Processed {job.processed} markdown files for {job.name}.")
+        if job.result_cache is not None:
+            logger.info(job.result_cache.summary())
+            job.result_cache.evict()
 
 
+def process_markdown_files(directory, bedrock_client, result_cache=None, journal=None, completed=None, shard=None,
+                           config=None):
+    """Process markdown files concurrently.
 
+    Results are returned as a list, or, when a ResultJournal is given, appended to
+    the journal as each file completes and not kept in memory.
+    """
+    config = dict(config or get_config(), MARKDOWN_DIRECTORY=directory)
+    job = jobs.Job(config, result_cache, journal, completed, shard)
+    try:
+        process_jobs([job], bedrock_client, config['MAX_WORKERS'])
+        return job.results
+    except Exception as e:
+        logging.getLogger("MarkdownProcessor").error(f"Error in process_markdown_files: {str(e)}")
+        return []
@@ -0,0 +1,413 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from metrics import percentile
+import clients
+import throttle
+
+logger = logging.getLogger(__name__)
+
+# Monotonic time by which the file being processed must finish, set by file_deadline().
+_file_deadline = contextvars.ContextVar('file_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def file_deadline(seconds):
+    """Bound every Bedrock call made inside the block by a shared deadline `seconds` from now (no-op if falsy)."""
+    if not seconds:
+        yield
+        return
+    token = _file_deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _file_deadline.reset(token)
+
+
+def check_deadline():
+    deadline = _file_deadline.get()
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded("File deadline exceeded")
+
+
+class LatencyTracker:
+    """Recent call latencies, for the hedging threshold."""
+
+    def __init__(self, window=1000):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return percentile(ordered, pct)
+
+
+class HedgedBedrockClient:
+    """Adds per-call and per-file deadlines to invoke_model, and optionally hedges slow calls.
+
+    Each call runs on a private thread pool so the caller can stop waiting at its
+    deadline; an abandoned call finishes (or hits the botocore read timeout) in the
+    background. With hedge_percentile set, a call still running past that percentile
+    of the latencies seen so far gets a duplicate request, and the first answer wins.
+    Hedges only go out when the RateController has a free slot and budget right now,
+    and never for more than max_hedge_fraction of calls.
+    """
+
+    def __init__(self, client, raw_client, controller=None, call_timeout=None, hedge_percentile=None,
+                 min_samples=20, max_hedge_fraction=0.1, max_workers=20):
+        self.client = client
+        self.raw_client = raw_client
+        self.controller = controller
+        self.call_timeout = call_timeout
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.max_hedge_fraction = max_hedge_fraction
+        self.latencies = LatencyTracker()
+        self.calls = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+        self.deadlines_exceeded = 0
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _submit(self, func, *args, **kwargs):
+        with self._lock:
+            if self._executor is None:
+                # Room for every worker's call plus its hedge, and for abandoned calls still draining.
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers * 2 + 4,
+                                                                       thread_name_prefix="bedrock-call")
+        return self._executor.submit(func, *args, **kwargs)
+
+    def _timeout(self, start):
+        deadlines = []
+        if self.call_timeout:
+            deadlines.append(start + self.call_timeout)
+        if _file_deadline.get() is not None:
+            deadlines.append(_file_deadline.get())
+        return min(deadlines) - time.monotonic() if deadlines else None
+
+    def _hedge_threshold(self):
+        if not self.hedge_percentile:
+            return None
+        return self.latencies.percentile(self.hedge_percentile, self.min_samples)
+
+    def _hedge(self, kwargs):
+        """Send a hedge if max_hedge_fraction and the rate budget allow it; returns it, or None.
+
+        The hedge is counted against the fraction in the same step as the check,
+        so concurrent calls can't all pass it, and handed back if it isn't sent.
+        """
+        with self._lock:
+            if self.hedges >= self.max_hedge_fraction * self.calls:
+                return None
+            self.hedges += 1
+        hedge = self._send_hedge(kwargs)
+        if hedge is None:
+            with self._lock:
+                self.hedges -= 1
+                self.hedges_skipped += 1
+        return hedge
+
+    def _send_hedge(self, kwargs):
+        """Duplicate request on the raw client, only if the rate budget has room right now."""
+        estimated_tokens = throttle.estimate_request_tokens(kwargs.get('body', '{}'))
+        if self.controller is not None and not self.controller.try_acquire(estimated_tokens):
+            return None
+
+        def invoke():
+            throttled = False
+            try:
+                return self.raw_client.invoke_model(**kwargs)
+            except Exception as e:
+                throttled = throttle.is_throttle_error(e)
+                raise
+            finally:
+                if self.controller is not None:
+                    self.controller.release(throttled=throttled)
+
+        return self._submit(invoke)
+
+    def invoke_model(self, **kwargs):
+        check_deadline()
+        start = time.monotonic()
+        with self._lock:
+            self.calls += 1
+        primary = self._submit(self.client.invoke_model, **kwargs)
+        pending = {primary}
+
+        hedge_after = self._hedge_threshold()
+        timeout = self._timeout(start)
+        if hedge_after is not None and (timeout is None or hedge_after < timeout):
+            done, _ = concurrent.futures.wait(pending, timeout=hedge_after)
+            if not done:
+                hedge = self._hedge(kwargs)
+                if hedge is not None:
+                    pending.add(hedge)
+
+        error = None
+        while pending:
+            timeout = self._timeout(start)
+            if timeout is not None and timeout <= 0:
+                break
+            done, pending = concurrent.futures.wait(pending, timeout=timeout,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self.latencies.add(time.monotonic() - start)
+                    if future is not primary:
+                        with self._lock:
+                            self.hedges_won += 1
+                    return future.result()
+                # A failed hedge is ignored while the primary can still answer.
+                if future is primary or error is None:
+                    error = future.exception()
+        if error is not None and not pending:
+            raise error
+        raise self._deadline_exceeded(start)
+
+    def _deadline_exceeded(self, start):
+        with self._lock:
+            self.deadlines_exceeded += 1
+        return DeadlineExceeded(f"No response from Bedrock within {time.monotonic() - start:.1f}s")
+
+    def _result_by_deadline(self, future, start, abandon):
+        """future's result, or DeadlineExceeded at the deadline; an abandoned future is passed to abandon() when done."""
+        timeout = self._timeout(start)
+        done, _ = concurrent.futures.wait([future], timeout=None if timeout is None else max(0.0, timeout))
+        if not done:
+            future.add_done_callback(abandon)
+            raise self._deadline_exceeded(start)
+        return future.result()
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        """invoke_model_with_response_stream under the same deadlines; streamed calls aren't hedged.
+
+        The call and every read from its stream run on the pool, so a stalled
+        stream raises DeadlineExceeded at the deadline.
+        """
+        check_deadline()
+        start = time.monotonic()
+        future = self._submit(self.client.invoke_model_with_response_stream, **kwargs)
+        response = self._result_by_deadline(future, start, _close_abandoned_response)
+        response['body'] = DeadlineEventStream(response['body'], self, start)
+        return response
+
+    def as_dict(self):
+        with self._lock:
+            return {"calls": self.calls, "hedges": self.hedges, "hedges_won": self.hedges_won,
+                    "hedges_skipped_for_budget": self.hedges_skipped, "deadlines_exceeded": self.deadlines_exceeded}
+
+    def summary(self):
+        stats = self.as_dict()
+        return (f"Deadlines and hedging: {stats['calls']} calls, {stats['hedges']} hedged "
+                f"({stats['hedges_won']} won, {stats['hedges_skipped_for_budget']} skipped for rate budget), "
+                f"{stats['deadlines_exceeded']} deadlines exceeded")
+
+    def close(self):
+        # Abandoned calls are left to finish on their own.
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+class AsyncHedgedBedrockClient(HedgedBedrockClient):
+    """HedgedBedrockClient for a client whose methods are coroutines.
+
+    The call and its hedge run as tasks on the event loop instead of on a thread
+    pool, and whichever loses (or outlives the deadline) is cancelled.
+    """
+
+    def _send_hedge(self, kwargs):
+        estimated_tokens = throttle.estimate_request_tokens(kwargs.get('body', '{}'))
+        if self.controller is not None and not self.controller.try_acquire(estimated_tokens):
+            return None
+
+        async def invoke():
+            throttled = False
+            try:
+                return await self.raw_client.invoke_model(**kwargs)
+            except Exception as e:
+                throttled = throttle.is_throttle_error(e)
+                raise
+            finally:
+                if self.controller is not None:
+                    self.controller.release(throttled=throttled)
+
+        return asyncio.ensure_future(invoke())
+
+    async def invoke_model(self, **kwargs):
+        check_deadline()
+        start = time.monotonic()
+        with self._lock:
+            self.calls += 1
+        primary = asyncio.ensure_future(self.client.invoke_model(**kwargs))
+        tasks = [primary]
+        pending = {primary}
+
+        try:
+            hedge_after = self._hedge_threshold()
+            timeout = self._timeout(start)
+            if hedge_after is not None and (timeout is None or hedge_after < timeout):
+                done, _ = await asyncio.wait(pending, timeout=hedge_after)
+                if not done:
+                    hedge = self._hedge(kwargs)
+                    if hedge is not None:
+                        tasks.append(hedge)
+                        pending.add(hedge)
+
+            error = None
+            while pending:
+                timeout = self._timeout(start)
+                if timeout is not None and timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.latencies.add(time.monotonic() - start)
+                        if task is not primary:
+                            with self._lock:
+                                self.hedges_won += 1
+                        return task.result()
+                    if task is primary or error is None:
+                        error = task.exception()
+            if error is not None and not pending:
+                raise error
+            raise self._deadline_exceeded(start)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Mark a losing task's error as seen.
+                    task.exception()
+
+    async def _wait_by_deadline(self, awaitable, start):
+        """Await awaitable, cancelling it with DeadlineExceeded at the deadline."""
+        try:
+            return await asyncio.wait_for(awaitable, self._timeout(start))
+        except asyncio.TimeoutError:
+            raise self._deadline_exceeded(start)
+
+    async def invoke_model_with_response_stream(self, **kwargs):
+        check_deadline()
+        start = time.monotonic()
+        response = await self._wait_by_deadline(self.client.invoke_model_with_response_stream(**kwargs), start)
+        response['body'] = AsyncDeadlineEventStream(response['body'], self, start)
+        return response
+
+
+# Returned by next() for an exhausted stream, since StopIteration can't cross a future.
+_END_OF_STREAM = object()
+
+
+def _close_abandoned_response(future):
+    if future.exception() is None:
+        close = getattr(future.result()['body'], 'close', None)
+        if close is not None:
+            close()
+
+
+class DeadlineEventStream:
+    """Reads a response event stream on the hedging client's pool, stopping with DeadlineExceeded at the deadline.
+
+    Closing it while a read is still pending closes the stream once that read returns.
+    """
+
+    def __init__(self, stream, hedged_client, start):
+        self.stream = stream
+        self.hedged_client = hedged_client
+        self.start = start
+        self._pending = None
+        self._closed = False
+
+    def __iter__(self):
+        iterator = iter(self.stream)
+        try:
+            while True:
+                self._pending = self.hedged_client._submit(next, iterator, _END_OF_STREAM)
+                event = self.hedged_client._result_by_deadline(self._pending, self.start, lambda future: None)
+                if event is _END_OF_STREAM:
+                    return
+                yield event
+        finally:
+            self.close()
+
+    def close(self):
+        if self._pending is not None and not self._pending.done():
+            self._pending.add_done_callback(lambda future: self._close_stream())
+        else:
+            self._close_stream()
+
+    def _close_stream(self):
+        if self._closed:
+            return
+        self._closed = True
+        close = getattr(self.stream, 'close', None)
+        if close is not None:
+            close()
+
+
+class AsyncDeadlineEventStream:
+    """DeadlineEventStream for an async event stream; a read still waiting at the deadline is cancelled."""
+
+    def __init__(self, stream, hedged_client, start):
+        self.stream = stream
+        self.hedged_client = hedged_client
+        self.start = start
+
+    async def __aiter__(self):
+        iterator = self.stream.__aiter__()
+        try:
+            while True:
+                try:
+                    event = await self.hedged_client._wait_by_deadline(iterator.__anext__(), self.start)
+                except StopAsyncIteration:
+                    return
+                yield event
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        await clients.close_stream(self.stream)
+
+
+def create_hedged_client(client, raw_client, controller, config, max_concurrency):
+    """Wrap client in a HedgedBedrockClient when a deadline or hedging is configured.
+
+    Returns (client, hedged_client); hedged_client is None when neither is enabled.
+    """
+    call_timeout = config.get('BEDROCK_CALL_DEADLINE_SECONDS', 0)
+    hedge_percentile = config.get('HEDGE_PERCENTILE', 95) if config.get('HEDGING_ENABLED', False) else None
+    if not call_timeout and not hedge_percentile and not config.get('FILE_DEADLINE_SECONDS', 0):
+        return client, None
+
+    client_class = AsyncHedgedBedrockClient if clients.is_async_client(client) else HedgedBedrockClient
+    hedged_client = client_class(
+        client, raw_client, controller,
+        call_timeout=call_timeout or None,
+        hedge_percentile=hedge_percentile,
+        min_samples=config.get('HEDGE_MIN_SAMPLES', 20),
+        max_hedge_fraction=config.get('HEDGE_MAX_FRACTION', 0.1),
+        max_workers=max_concurrency
+    )
+    return hedged_client, hedged_client
@@ -0,0 +1,146 @@
+import itertools
+import logging
+import os
+import time
+import journal
+
+logger = logging.getLogger(__name__)
+
+# Every job needs its own guide, markdown build and output file.
+REQUIRED_JOB_KEYS = ('SERVICE_NAME', 'MARKDOWN_DIRECTORY', 'OUTPUT_CSV_FILE')
+# Per-job output files that default to a path next to the job's OUTPUT_CSV_FILE.
+JOB_OUTPUT_KEYS = ('JOURNAL_FILE',)
+# Settings of the process-wide client, scheduler and rate budget, which jobs can't override.
+SHARED_KEYS = (
+    'MAX_WORKERS', 'MAX_IN_FLIGHT', 'ENGINE',
+    'RATE_LIMIT_ENABLED', 'RATE_LIMIT_RPM', 'RATE_LIMIT_TPM', 'THROTTLE_MAX_RETRIES',
+    'BEDROCK_CLIENT_FACTORY', 'BEDROCK_CLIENT_MODE', 'BEDROCK_CONNECT_TIMEOUT', 'BEDROCK_READ_TIMEOUT',
+    'BEDROCK_CALL_DEADLINE_SECONDS', 'HEDGING_ENABLED', 'HEDGE_PERCENTILE', 'HEDGE_MIN_SAMPLES', 'HEDGE_MAX_FRACTION',
+    'LOGGING_DIR', 'LOG_QUEUE_ENABLED', 'RUN_REPORT_FILE', 'PROMETHEUS_FILE',
+)
+
+
+def job_configs(config):
+    """One config per entry in JOBS: the top-level config overlaid with the job's own keys.
+
+    Without JOBS, the top-level config is the only job. Each job gets a NAME
+    (by default its output file name) and must end up with its own
+    SERVICE_NAME, MARKDOWN_DIRECTORY and OUTPUT_CSV_FILE. A JOURNAL_FILE is
+    only taken from the job itself, otherwise it follows the job's CSV.
+    """
+    entries = config.get('JOBS')
+    if not entries:
+        return [config]
+
+    configs = []
+    for position, entry in enumerate(entries, 1):
+        job_config = {key: value for key, value in config.items() if key != 'JOBS'}
+        # A top-level output path would be shared by every job, so jobs fall back to their own default instead.
+        for key in JOB_OUTPUT_KEYS:
+            job_config.pop(key, None)
+        job_config.update(entry)
+        if job_config.get('OUTPUT_CSV_FILE') and not entry.get('NAME'):
+            job_config['NAME'] = os.path.splitext(os.path.basename(job_config['OUTPUT_CSV_FILE']))[0]
+        name = job_config.get('NAME') or f"job {position}"
+
+        missing = [key for key in REQUIRED_JOB_KEYS if not job_config.get(key)]
+        if missing:
+            raise ValueError(f"Job {name} is missing {', '.join(missing)}")
+        overridden = [key for key in SHARED_KEYS if key in entry]
+        if overridden:
+            logger.warning(f"Job {name} sets {', '.join(overridden)}, which only apply to the whole run; ignoring them")
+            for key in overridden:
+                if key in config:
+                    job_config[key] = config[key]
+                else:
+                    del job_config[key]
+        configs.append(job_config)
+
+    for key in ('NAME', 'OUTPUT_CSV_FILE', 'JOURNAL_FILE'):
+        values = [journal.journal_path(job_config) if key == 'JOURNAL_FILE' else job_config[key]
+                  for job_config in configs]
+        duplicates = sorted({value for value in values if values.count(value) > 1})
+        if duplicates:
+            raise ValueError(f"Jobs must have distinct {key} values, found duplicates: {', '.join(duplicates)}")
+    return configs
+
+
+def report_path(config, configs):
+    """Where the run report goes: RUN_REPORT_FILE, or next to the output CSV (the first job's, with JOBS) by default."""
+    if config.get('RUN_REPORT_FILE'):
+        return config['RUN_REPORT_FILE']
+    if config.get('JOBS'):
+        return os.path.join(os.path.dirname(configs[0]['OUTPUT_CSV_FILE']), "jobs.report.json")
+    return f"{configs[0]['OUTPUT_CSV_FILE']}.report.json"
+
+
+def round_robin(iterables):
+    """Take one item from each iterable in turn, dropping iterables as they run out."""
+    iterators = [iter(iterable) for iterable in iterables]
+    while iterators:
+        for iterator in list(iterators):
+            try:
+                yield next(iterator)
+            except StopIteration:
+                iterators.remove(iterator)
+
+
+class Job:
+    """One guide's share of a generation run: its config, result cache and journal, and how it went.
+
+    The engines take their work from all jobs in turn, so every job keeps
+    making progress against the shared worker pool and rate budget.
+    """
+
+    def __init__(self, config, result_cache=None, journal=None, completed=None, shard=None):
+        self.config = config
+        self.name = config.get('NAME') or config['SERVICE_NAME']
+        self.directory = config['MARKDOWN_DIRECTORY']
+        self.result_cache = result_cache
+        self.journal = journal
+        self.completed = completed
+        self.shard = shard
+        self.results = []
+        self.processed = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.finished_seconds = None
+
+    def record(self, result):
+        """Keep a completed file's result, or count it as failed if there is none."""
+        if result:
+            if self.journal is not None:
+                self.journal.append(result)
+            else:
+                self.results.append(result)
+            self.processed += 1
+        else:
+            self.failed += 1
+        self.finished_seconds = time.perf_counter() - self.started
+
+    def as_dict(self):
+        summary = {
+            "name": self.name,
+            "service_name": self.config['SERVICE_NAME'],
+            "output_csv": self.config.get('OUTPUT_CSV_FILE'),
+            "files_processed": self.processed,
+            "files_failed": self.failed,
+            "finished_after_seconds": round(self.finished_seconds or 0.0, 3),
+        }
+        if self.result_cache is not None:
+            summary["cache"] = {"hits": self.result_cache.hits, "misses": self.result_cache.misses}
+        return summary
+
+
+def tag_groups(jobs, groups_for_job):
+    """(job, group) pairs, alternating between jobs, where groups_for_job(job) gives one job's work."""
+    return round_robin([zip(itertools.repeat(job), groups_for_job(job)) for job in jobs])
+
+
+def format_summary(jobs):
+    lines = [f"{len(jobs)} jobs:"]
+    for job in jobs:
+        summary = job.as_dict()
+        lines.append(f"  {summary['name']}: {summary['files_processed']} processed, {summary['files_failed']} failed, "
+                     f"finished after {summary['finished_after_seconds']:.1f}s -> {summary['output_csv']}")
+    return '\n'.join(lines)
@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class ResultJournal:
+    """Append-only JSONL log of per-file results, written as each file completes.
+
+    Lines are flushed immediately and fsynced every `fsync_every` results, so a
+    crash loses at most the last unsynced batch. Intended for a single writer
+    (the thread collecting completed futures).
+    """
+
+    def __init__(self, path, resume=False, fsync_every=10):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if resume and self.file.tell() > 0:
+            # Terminate a line torn by a crash so the next result starts on its own line.
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')
+
+    def append(self, result):
+        self.file.write(json.dumps(result) + '\n')
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _read_records(path):
+    if not os.path.exists(path):
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping unreadable line {line_number} in journal {path}")
+
+
+def read_journal(path, latest=False):
+    """Yield results from a journal, skipping duplicates and a torn final line from a crash.
+
+    The first result for a file wins, or with latest the last one does (--watch
+    journals a file again each time it changes); files keep their first position.
+    """
+    if latest:
+        results = {}
+        for result in _read_records(path):
+            results[result.get('File Name')] = result
+        yield from results.values()
+        return
+
+    seen = set()
+    for result in _read_records(path):
+        if result.get('File Name') in seen:
+            continue
+        seen.add(result.get('File Name'))
+        yield result
+
+
+def completed_files(path):
+    return {result.get('File Name') for result in read_journal(path)}
+
+
+def journal_path(config):
+    return config.get('JOURNAL_FILE') or f"{config['OUTPUT_CSV_FILE']}.journal.jsonl"
@@ -1,8 +1,14 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 from concurrent_log_handler import ConcurrentRotatingFileHandler
 import os
 import sys
 
+# Listener thread for queue mode; replaced on each setup_logging call.
+_queue_listener = None
+
 
 class NewLineStreamHandler(logging.StreamHandler):
     def emit(self, record):
@@ -18,7 +24,36 @@ class NewLineStreamHandler(logging.StreamHandler):
             self.handleError(record)
 
 
-def setup_logging(log_level=logging.INFO, log_dir='logs'):
+class DocumentContextFilter(logging.Filter):
+    """Gives every record a `doc` attribute so the format string can show which file it's about.
+
+    Per-file context is attached with logging.LoggerAdapter(logger, {"doc": filename})
+    on a fixed set of loggers, rather than creating a logger per file.
+    """
+
+    def filter(self, record):
+        if not hasattr(record, 'doc'):
+            record.doc = '-'
+        return True
+
+
+def stop_logging():
+    """Flush and stop the queue listener, if one is running."""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+
+def setup_logging(log_level=logging.INFO, log_dir='logs', use_queue=False):
+    """Configure the root logger.
+
+    With use_queue, worker threads only put records on a queue; a single listener
+    thread does the formatting and the (file-locking) I/O.
+    """
+    global _queue_listener
+    stop_logging()
+
     # Create logs directory if it doesn't exist
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
@@ -32,13 +67,15 @@ def setup_logging(log_level=logging.INFO, log_dir='logs'):
         root_logger.removeHandler(handler)
 
     # Create a formatter
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(doc)s - %(levelname)s - %(message)s')
+    context_filter = DocumentContextFilter()
 
     # Console handler for warnings and errors (always enabled)
     console_handler = NewLineStreamHandler(sys.stderr)
     console_handler.setFormatter(formatter)
     console_handler.setLevel(logging.WARNING)
-    root_logger.addHandler(console_handler)
+    console_handler.addFilter(context_filter)
+    handlers = [console_handler]
 
     # File handler (thread-safe, for all log levels)
     try:
@@ -49,8 +86,26 @@ def setup_logging(log_level=logging.INFO, log_dir='logs'):
         )
         file_handler.setFormatter(formatter)
         file_handler.setLevel(logging.DEBUG)  # Capture all log levels
-        root_logger.addHandler(file_handler)
+        file_handler.addFilter(context_filter)
+        handlers.append(file_handler)
     except Exception as e:
-        root_logger.error(f"Failed to set up file logging: {e}")
+        file_logging_error = e
+    else:
+        file_logging_error = None
+
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _queue_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _queue_listener.start()
+    else:
+        for handler in handlers:
+            root_logger.addHandler(handler)
+
+    if file_logging_error is not None:
+        root_logger.error(f"Failed to set up file logging: {file_logging_error}")
+
+    return root_logger
+
 
-    return root_logger
\ No newline at end of file
+atexit.register(stop_logging)
\ No newline at end of file
@@ -1,15 +1,24 @@
+import contextlib
 import os
-import utils, generate, logging_config, modify, prompts
+import utils, logging_config, modify, section_index, shard, env_cache
 import logging
 import argparse
 from config import load_config, get_config
-from botocore.exceptions import BotoCoreError, ClientError
 
 def main():
     parser = argparse.ArgumentParser(description="Process markdown files and modify XML with configurable settings.")
     parser.add_argument("--config", default="config.yaml", help="Path to the configuration file")
     parser.add_argument("--verify", action="store_true", help="Run verification only")
     parser.add_argument("--modify-xml", action="store_true", help="Run XML modification")
+    parser.add_argument("--dry-run", action="store_true", help="With --modify-xml, print a diff of the changes instead of writing them")
+    parser.add_argument("--resume", action="store_true", help="Skip files already recorded in the results journal from a previous run")
+    parser.add_argument("--shard", type=shard.parse_shard, metavar="INDEX/COUNT",
+                        help="Process only this shard of the markdown files, e.g. 0/4, writing a per-shard CSV")
+    parser.add_argument("--merge", nargs="+", metavar="SHARD_CSV",
+                        help="Merge per-shard CSVs into OUTPUT_CSV_FILE, reporting duplicate and missing files")
+    parser.add_argument("--engine", choices=["threads", "async"], help="Generation engine (overrides ENGINE in the config)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running, regenerating changed markdown files and patching their XML sections")
     args = parser.parse_args()
 
     try:
@@ -18,11 +27,29 @@ def main():
 
         logger = logging_config.setup_logging(
             log_level=logging.DEBUG,  # Capture all log levels in the file
-            log_dir=config['LOGGING_DIR']
+            log_dir=config['LOGGING_DIR'],
+            use_queue=config.get('LOG_QUEUE_ENABLED', True)
         )
 
-        # Run Environment Checks
-        if not utils.verify_aws_environment(config):
+        # Merging shard CSVs is local only, no AWS needed
+        if args.merge:
+            expected_files = None
+            if os.path.isdir(config['MARKDOWN_DIRECTORY']):
+                expected_files = {os.path.basename(f) for f in utils.discover_markdown_files(
+                    config['MARKDOWN_DIRECTORY'],
+                    include=config.get('MARKDOWN_INCLUDE', ['*.md']),
+                    exclude=config.get('MARKDOWN_EXCLUDE', []),
+                    recursive=config.get('MARKDOWN_RECURSIVE', True))}
+            merged, duplicates, missing = shard.merge_shard_csvs(args.merge, config['OUTPUT_CSV_FILE'], expected_files)
+            print(f"Merged {merged} results into {config['OUTPUT_CSV_FILE']}: "
+                  f"{len(duplicates)} duplicates dropped, {len(missing)} markdown files missing.")
+            return
+
+        # Run Environment Checks, skipped when a custom (e.g. fake) Bedrock client is configured
+        check_cache = env_cache.create_check_cache(config)
+        if config.get('BEDROCK_CLIENT_FACTORY'):
+            logger.info(f"Skipping AWS environment checks for client factory {config['BEDROCK_CLIENT_FACTORY']}")
+        elif not utils.verify_aws_environment(config, check_cache):
             logger.error("AWS environment verification failed. Please check the logs and resolve any issues.")
             return
 
@@ -33,19 +60,107 @@ def main():
 
         # mode switch, modify xml vs regular (generate titles/abstracts)
         if args.modify_xml:
-            modify.modify_xml_files(config['REWRITE_INPUT_FILE'], config['XML_DIRECTORY'])
+            index = None
+            if config.get('XML_INDEX_ENABLED', True):
+                index = section_index.SectionIndex(config.get('XML_INDEX_FILE', 'output/section-index.json'))
+            modify.modify_xml_files(config['REWRITE_INPUT_FILE'], config['XML_DIRECTORY'],
+                                    workers=config.get('XML_WORKERS'), dry_run=args.dry_run,
+                                    log_dir=config['LOGGING_DIR'], index=index)
         else:
+            # Imported here so --verify and --modify-xml don't pay for botocore and tqdm at start-up.
+            import generate, async_generate, prompts, cache, throttle, journal, metrics, clients, hedging, watch, jobs
+
             try:
-                bedrock_client = utils.initialize_bedrock()
+                job_configs = jobs.job_configs(config)
+                if args.watch and len(job_configs) > 1:
+                    raise ValueError("--watch runs a single job, remove JOBS from the config")
+                if args.shard:
+                    for job_config in job_configs:
+                        job_config['OUTPUT_CSV_FILE'] = shard.shard_output_path(job_config['OUTPUT_CSV_FILE'], args.shard)
+                        logger.info(f"Processing shard {args.shard[0]}/{args.shard[1]}, "
+                                    f"writing to {job_config['OUTPUT_CSV_FILE']}")
 
-                prompts.validate_bedrock_connection(bedrock_client, config['BEDROCK_MODEL'])
+                # Watch cycles are a handful of files, regenerated on MAX_WORKERS threads.
+                engine = 'watch' if args.watch else args.engine or config.get('ENGINE', 'threads')
+                max_concurrency = config.get('MAX_IN_FLIGHT', 50) if engine == 'async' else config['MAX_WORKERS']
+                # One client, rate budget and scheduler are shared by every job.
+                raw_client, connection_stats = clients.create_bedrock_client(config, max_concurrency)
+                if engine != 'async' and clients.is_async_client(raw_client):
+                    raise ValueError(f"{config['BEDROCK_CLIENT_FACTORY']} returns an async client, which only the "
+                                     f"async engine can use; set ENGINE: async (without --watch)")
+                bedrock_client, rate_controller = throttle.create_throttled_client(raw_client, config, max_concurrency)
+                bedrock_client, hedged_client = hedging.create_hedged_client(
+                    bedrock_client, raw_client, rate_controller, config, max_concurrency)
+
+                for model_id in sorted({job_config['BEDROCK_MODEL'] for job_config in job_configs}):
+                    prompts.validate_bedrock_connection(bedrock_client, model_id, check_cache)
+                for job_config in job_configs:
+                    if prompts.prompt_caching_enabled(job_config):
+                        prompts.check_system_prefix(job_config['SERVICE_NAME'], job_config.get(
+                            'PROMPT_CACHE_MIN_TOKENS', prompts.PROMPT_CACHE_MIN_TOKENS))
 
                 logger.info("Starting concurrent markdown processing and analysis...")
-                results = generate.process_markdown_files(config['MARKDOWN_DIRECTORY'], bedrock_client)
-                utils.save_to_csv(results, config['OUTPUT_CSV_FILE'])
-                logger.info(f"Markdown analysis completed. Results saved to {config['OUTPUT_CSV_FILE']}")
+                run_metrics = metrics.start_run()
+                job_list = []
+                with contextlib.ExitStack() as journals:
+                    for job_config in job_configs:
+                        journal_path = journal.journal_path(job_config)
+                        completed = journal.completed_files(journal_path) if args.resume else None
+                        # Watching adds to the existing results rather than starting a new journal.
+                        result_journal = journals.enter_context(journal.ResultJournal(
+                            journal_path, resume=args.resume or args.watch,
+                            fsync_every=job_config.get('JOURNAL_FSYNC_EVERY', 10)))
+                        job_list.append(jobs.Job(job_config, cache.create_cache(job_config), result_journal,
+                                                 completed, args.shard))
+
+                    if args.watch:
+                        job = job_list[0]
+                        index = None
+                        if job.config.get('XML_INDEX_ENABLED', True):
+                            index = section_index.SectionIndex(job.config.get('XML_INDEX_FILE', 'output/section-index.json'))
+                        watch.MarkdownWatcher(job.directory, bedrock_client, job.result_cache, job.journal, index,
+                                              job.config).run()
+                    elif engine == 'async':
+                        async_generate.process_jobs_async(job_list, bedrock_client, max_concurrency)
+                    else:
+                        generate.process_jobs(job_list, bedrock_client, max_concurrency)
+                extra = {"engine": engine, "max_concurrency": max_concurrency}
+                if len(job_list) > 1:
+                    extra["jobs"] = [job.as_dict() for job in job_list]
+                if rate_controller is not None:
+                    logger.info(rate_controller.summary())
+                    extra["rate_limit"] = {"requests": rate_controller.requests, "throttles": rate_controller.throttles,
+                                           "final_concurrency": int(rate_controller.limit)}
+                if hedged_client is not None:
+                    logger.info(hedged_client.summary())
+                    extra["hedging"] = hedged_client.as_dict()
+                    hedged_client.close()
+                if connection_stats is not None:
+                    logger.info(connection_stats.summary())
+                    extra["connections"] = connection_stats.as_dict()
+                result_caches = [job.result_cache for job in job_list if job.result_cache is not None]
+                if result_caches:
+                    extra["cache"] = {"hits": sum(c.hits for c in result_caches),
+                                      "misses": sum(c.misses for c in result_caches)}
+                report_file = jobs.report_path(config, job_configs)
+                report = run_metrics.write_report(report_file, config, extra)
+                logger.info(f"Run report written to {report_file}: {report['files_per_minute']} files/min, "
+                            f"{report['tokens']['input']} input / {report['tokens']['output']} output tokens, "
+                            f"~${report['estimated_cost_usd']}")
+                if config.get('PROMETHEUS_FILE'):
+                    with open(config['PROMETHEUS_FILE'], 'w') as f:
+                        f.write(run_metrics.to_prometheus(config))
+                for job in job_list:
+                    utils.save_to_csv(journal.read_journal(job.journal.path, latest=args.watch),
+                                      job.config['OUTPUT_CSV_FILE'])
+                    logger.info(f"Markdown analysis completed. Results saved to {job.config['OUTPUT_CSV_FILE']}")
+                if len(job_list) > 1:
+                    summary = jobs.format_summary(job_list)
+                    print(summary)
+                    logger.info(summary)
             except Exception as e:
                 logger.error(f"Error during markdown processing: {e}", exc_info=True)
+                return
 
         logger.info("Process completed successfully.")
     except Exception as e:
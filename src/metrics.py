@@ -0,0 +1,175 @@
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+# Claude 3 Sonnet on-demand pricing (USD per 1,000 tokens); override with PRICE_PER_1K_INPUT_TOKENS/PRICE_PER_1K_OUTPUT_TOKENS.
+DEFAULT_PRICE_PER_1K_INPUT_TOKENS = 0.003
+DEFAULT_PRICE_PER_1K_OUTPUT_TOKENS = 0.015
+
+# Prompt cache writes and reads are billed relative to the input token price.
+CACHE_WRITE_PRICE_FACTOR = 1.25
+CACHE_READ_PRICE_FACTOR = 0.1
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct * len(sorted_values) / 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class RunMetrics:
+    """Thread-safe per-stage timings, Bedrock token usage and counters for one run."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stage_seconds = defaultdict(list)
+        self.usage = defaultdict(lambda: defaultdict(int))
+        self.counters = defaultdict(int)
+        # (seconds since the run started, file name, seconds spent on the file) per completed file.
+        self.files = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - start)
+
+    def record_stage(self, name, seconds):
+        with self._lock:
+            self.stage_seconds[name].append(seconds)
+
+    def record_usage(self, stage, usage):
+        """Add the `usage` block of a Bedrock response (input_tokens, output_tokens, ...) to the stage totals."""
+        with self._lock:
+            for key, value in (usage or {}).items():
+                if isinstance(value, int):
+                    self.usage[stage][key] += value
+
+    def record_file(self, filename, seconds):
+        with self._lock:
+            self.files.append((time.perf_counter() - self._start, filename, seconds))
+
+    def stragglers(self, tail_pct=95, slowest=5):
+        """How long the run spent finishing its last (100 - tail_pct)% of files, and the slowest files."""
+        with self._lock:
+            files = list(self.files)
+        if not files:
+            return {}
+        completions = sorted(completed for completed, _, _ in files)
+        tail_start = percentile(completions, tail_pct)
+        return {
+            "tail_percent": 100 - tail_pct,
+            "tail_seconds": round(completions[-1] - tail_start, 3),
+            "tail_fraction_of_run": round((completions[-1] - tail_start) / completions[-1], 3) if completions[-1] else 0.0,
+            "slowest_files": [{"file": filename, "seconds": round(seconds, 3)}
+                              for _, filename, seconds in sorted(files, key=lambda f: f[2], reverse=True)[:slowest]],
+        }
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def report(self, config=None, extra=None):
+        config = config or {}
+        elapsed = time.perf_counter() - self._start
+        with self._lock:
+            stages = {}
+            for name, samples in self.stage_seconds.items():
+                ordered = sorted(samples)
+                stages[name] = {
+                    "count": len(ordered),
+                    "total_seconds": round(sum(ordered), 4),
+                    "mean_seconds": round(sum(ordered) / len(ordered), 4),
+                    **{f"p{pct}_seconds": round(percentile(ordered, pct), 4) for pct in PERCENTILES},
+                }
+            usage = {stage: dict(values) for stage, values in self.usage.items()}
+            counters = dict(self.counters)
+
+        input_tokens = sum(values.get("input_tokens", 0) for values in usage.values())
+        output_tokens = sum(values.get("output_tokens", 0) for values in usage.values())
+        cache_read_tokens = sum(values.get("cache_read_input_tokens", 0) for values in usage.values())
+        cache_creation_tokens = sum(values.get("cache_creation_input_tokens", 0) for values in usage.values())
+        input_price = config.get('PRICE_PER_1K_INPUT_TOKENS', DEFAULT_PRICE_PER_1K_INPUT_TOKENS) / 1000
+        cost = ((input_tokens + cache_creation_tokens * CACHE_WRITE_PRICE_FACTOR
+                 + cache_read_tokens * CACHE_READ_PRICE_FACTOR) * input_price
+                + output_tokens / 1000 * config.get('PRICE_PER_1K_OUTPUT_TOKENS', DEFAULT_PRICE_PER_1K_OUTPUT_TOKENS))
+        files = counters.get("files_processed", 0)
+
+        report = {
+            "started": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_minute": round(files / elapsed * 60, 2) if elapsed else 0.0,
+            "stages": stages,
+            "tokens": {
+                "input": input_tokens,
+                "output": output_tokens,
+                "cache_read": cache_read_tokens,
+                "cache_creation": cache_creation_tokens,
+                "by_stage": usage,
+            },
+            "estimated_cost_usd": round(cost, 4),
+            "counters": counters,
+            "stragglers": self.stragglers(),
+        }
+        if extra:
+            report.update(extra)
+        return report
+
+    def write_report(self, path, config=None, extra=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        report = self.report(config, extra)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    def to_prometheus(self, config=None):
+        """Render the report in the Prometheus text exposition format (e.g. for a node_exporter textfile)."""
+        report = self.report(config)
+        lines = [
+            "# TYPE tcx3_run_elapsed_seconds gauge",
+            f"tcx3_run_elapsed_seconds {report['elapsed_seconds']}",
+            "# TYPE tcx3_stage_seconds summary",
+        ]
+        for stage, stats in report["stages"].items():
+            for pct in PERCENTILES:
+                lines.append(f'tcx3_stage_seconds{{stage="{stage}",quantile="{pct / 100}"}} {stats[f"p{pct}_seconds"]}')
+            lines.append(f'tcx3_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]}')
+            lines.append(f'tcx3_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines.append("# TYPE tcx3_tokens_total counter")
+        for stage, values in report["tokens"]["by_stage"].items():
+            for kind, value in values.items():
+                lines.append(f'tcx3_tokens_total{{stage="{stage}",kind="{kind}"}} {value}')
+        lines.append("# TYPE tcx3_estimated_cost_usd gauge")
+        lines.append(f"tcx3_estimated_cost_usd {report['estimated_cost_usd']}")
+        for name, value in report["counters"].items():
+            lines.append(f"# TYPE tcx3_{name}_total counter")
+            lines.append(f"tcx3_{name}_total {value}")
+        return '\n'.join(lines) + '\n'
+
+
+_run_metrics = RunMetrics()
+
+
+def start_run():
+    """Reset the metrics collected by get_run_metrics() for a new run."""
+    global _run_metrics
+    _run_metrics = RunMetrics()
+    return _run_metrics
+
+
+def get_run_metrics():
+    return _run_metrics
@@ -1,86 +1,270 @@
+import concurrent.futures
+import csv
+import difflib
+import itertools
 import logging
-from config import get_config
-import pandas as pd
 import os
 import re
+import shutil
+import tempfile
+import logging_config
 
+SECTION_PATTERN = re.compile(r'<section\s+[^>]*id="([^"]+)"[^>]*>')
+GENERATED_CONTENT_MARKER = 'START_AUTO_GENERATED_CONTENT'
+GENERATED_CONTENT_END = 'END_AUTO_GENERATED_CONTENT -->'
+# How far past a section tag to look for previously inserted content.
+MARKER_WINDOW = 100
 
-def modify_xml_files(csv_path, xml_directory):
-    logger = logging.getLogger(__name__)
-    logger.info(f"Starting XML modification process")
-    logger.info(f"CSV file path: {csv_path}")
-    logger.info(f"XML directory: {xml_directory}")
 
-    try:
-        # Read the CSV file
-        df = pd.read_csv(csv_path)
-        logger.info(f"Successfully read CSV file. Found {len(df)} rows.")
-
-        # Remove ".md" suffix from ID column
-        df['File Name'] = df['File Name'].str.replace('.md$', '', regex=True)
-        logger.debug("Removed '.md' suffix from 'File Name' column")
-
-        # Iterate through all XML files in the directory and its subdirectories
-        for root, dirs, files in os.walk(xml_directory):
-            for file in files:
-                if file.endswith('.xml'):
-                    file_path = os.path.join(root, file)
-                    logger.debug(f"Processing file: {file_path}")
-
-                    try:
-                        with open(file_path, 'r') as f:
-                            content = f.read()
-
-                        # Find all section tags with id attribute
-                        sections = re.findall(r'<section\s+[^>]*id="([^"]+)"[^>]*>', content)
-                        logger.debug(f"Found {len(sections)} sections in {file}")
-
-                        modified = False
-                        for section_id in sections:
-                            # Find matching row in CSV
-                            row = df[df['File Name'] == section_id]
-                            if not row.empty:
-                                title = row['AI Generated Title'].values[0]
-                                abstract = row['AI Generated Abstract'].values[0]
-                                logger.debug(f"Found matching data for section ID: {section_id}")
-
-                                # Create new XML lines wrapped in a comment with unique markers
-                                new_lines = f'''
+def load_rewrite_rows(csv_path):
+    """Read the generation CSV into {section_id: (title, abstract)}.
+
+    Section IDs are file names without the ".md" suffix. If an ID appears more
+    than once, the first row wins.
+    """
+    rows = {}
+    with open(csv_path, 'r', newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            section_id = re.sub(r'\.md$', '', row['File Name'])
+            if section_id not in rows:
+                rows[section_id] = (row['AI Generated Title'], row['AI Generated Abstract'])
+    return rows
+
+
+def render_generated_content(section_id, title, abstract):
+    # New XML lines wrapped in a comment with unique markers
+    return f'''
     <!-- START_AUTO_GENERATED_CONTENT
     <title id="{section_id}.title">{title}</title>
     <abstract><para>{abstract}</para></abstract>
     END_AUTO_GENERATED_CONTENT -->
     '''
 
-                                # Find the position to insert the new lines
-                                section_start = re.search(f'<section\\s+[^>]*id="{section_id}"[^>]*>', content)
-                                if section_start:
-                                    insert_pos = section_start.end()
-
-                                    # Check if the content already exists
-                                    if 'START_AUTO_GENERATED_CONTENT' not in content[insert_pos:insert_pos + 100]:
-                                        # Insert the new lines
-                                        content = content[:insert_pos] + new_lines + content[insert_pos:]
-                                        modified = True
-                                        logger.info(f"Added new content for section ID: {section_id}")
-                                    else:
-                                        logger.debug(f"Content already exists for section ID: {section_id}")
-                                else:
-                                    logger.warning(f"Could not find section start for ID: {section_id}")
-                            else:
-                                logger.warning(f"No matching data found for section ID: {section_id}")
-
-                        # Write the modified content back to the file only if changes were made
-                        if modified:
-                            with open(file_path, 'w') as f:
-                                f.write(content)
-                            logger.info(f"Successfully modified {file_path}")
-                        else:
-                            logger.info(f"No changes needed for {file_path}")
-                    except Exception as e:
-                        logger.error(f"Error processing file {file_path}: {str(e)}", exc_info=True)
 
+def rewrite_sections(content, rows, logger, replace=False):
+    """Insert generated content after every matching <section> tag in one pass over content.
+
+    Returns (new_content, changes) where changes maps "added", "replaced",
+    "existing" and "unmatched" to lists of section IDs. Sections that already
+    have generated content right after the tag are left alone, unless replace
+    is set, in which case that content is swapped for the new title and
+    abstract. A repeated ID is only handled at its first occurrence.
+    """
+    pieces = []
+    changes = {"added": [], "replaced": [], "existing": [], "unmatched": []}
+    seen = set()
+    last = 0
+
+    for match in SECTION_PATTERN.finditer(content):
+        section_id = match.group(1)
+        if section_id in seen:
+            continue
+        seen.add(section_id)
+
+        row = rows.get(section_id)
+        if row is None:
+            # Replacing is done for a handful of changed sections, so the rest are expected.
+            level = logging.DEBUG if replace else logging.WARNING
+            logger.log(level, f"No matching data found for section ID: {section_id}")
+            changes["unmatched"].append(section_id)
+            continue
+
+        insert_pos = match.end()
+        title, abstract = row
+        if GENERATED_CONTENT_MARKER in content[insert_pos:insert_pos + MARKER_WINDOW]:
+            end_pos = content.find(GENERATED_CONTENT_END, insert_pos) if replace else -1
+            if end_pos == -1:
+                logger.debug(f"Content already exists for section ID: {section_id}")
+                changes["existing"].append(section_id)
+                continue
+            end_pos += len(GENERATED_CONTENT_END)
+            # The whitespace that followed the inserted block is still in place after end_pos.
+            generated = render_generated_content(section_id, title, abstract).rstrip()
+            if content[insert_pos:end_pos] == generated:
+                changes["existing"].append(section_id)
+                continue
+            pieces.append(content[last:insert_pos])
+            pieces.append(generated)
+            last = end_pos
+            changes["replaced"].append(section_id)
+            logger.info(f"Replaced generated content for section ID: {section_id}")
+            continue
+
+        pieces.append(content[last:insert_pos])
+        pieces.append(render_generated_content(section_id, title, abstract))
+        last = insert_pos
+        changes["added"].append(section_id)
+        logger.info(f"Added new content for section ID: {section_id}")
+
+    if not changes["added"] and not changes["replaced"]:
+        return content, changes
+
+    pieces.append(content[last:])
+    return ''.join(pieces), changes
+
+
+def write_atomic(file_path, content, fsync=True):
+    """Replace file_path with content via a temp file in the same directory, so a crash never leaves a partial file.
+
+    The temp file is unique, so concurrent writers never rename each other's.
+    Without fsync the new content may not survive a power loss.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Set in each worker process by _init_worker so the rows aren't pickled per file.
+_worker_rows = None
+
+
+def _init_worker(rows, log_dir):
+    global _worker_rows
+    _worker_rows = rows
+    # Spawned workers (the macOS default) start without the parent's handlers, and forked
+    # ones inherit a queue handler whose listener thread only runs in the parent.
+    if log_dir:
+        logging_config.setup_logging(log_dir=log_dir)
+
+
+def process_xml_file(file_path, dry_run=False, replace=False):
+    logger = logging.getLogger(__name__)
+    logger.debug(f"Processing file: {file_path}")
+    result = {"file": file_path, "added": [], "replaced": [], "existing": [], "unmatched": [],
+              "diff": None, "error": None}
+
+    try:
+        with open(file_path, 'r') as f:
+            original = f.read()
+
+        content, changes = rewrite_sections(original, _worker_rows, logger, replace=replace)
+        result.update(changes)
+
+        # Write the modified content back to the file only if changes were made
+        if changes["added"] or changes["replaced"]:
+            if dry_run:
+                result["diff"] = ''.join(difflib.unified_diff(
+                    original.splitlines(keepends=True), content.splitlines(keepends=True),
+                    fromfile=file_path, tofile=file_path))
+            else:
+                write_atomic(file_path, content)
+                logger.info(f"Successfully modified {file_path}")
+        else:
+            logger.info(f"No changes needed for {file_path}")
+    except Exception as e:
+        logger.error(f"Error processing file {file_path}: {str(e)}", exc_info=True)
+        result["error"] = str(e)
+    return result
+
+
+def find_xml_files(xml_directory):
+    # Iterate through all XML files in the directory and its subdirectories
+    for root, dirs, files in os.walk(xml_directory):
+        for file in files:
+            if file.endswith('.xml'):
+                yield os.path.join(root, file)
+
+
+def format_report(report, dry_run=False):
+    verb = "Would modify" if dry_run else "Modified"
+    lines = [
+        f"{verb} {len(report['modified_files'])} files, {report['unchanged_files']} unchanged, "
+        f"{len(report['failed_files'])} failed.",
+        f"Section IDs: {len(report['added'])} added, {len(report['existing'])} already had generated content, "
+        f"{len(report['unmatched'])} not in the CSV.",
+    ]
+    if report['replaced']:
+        lines.append(f"Replaced generated content for {len(report['replaced'])} section IDs.")
+    if report['unmatched']:
+        lines.append(f"Unmatched section IDs: {', '.join(sorted(report['unmatched']))}")
+    if report['missing_from_xml']:
+        lines.append(f"CSV section IDs not found in any XML file: {', '.join(report['missing_from_xml'])}")
+    if report['failed_files']:
+        lines.append(f"Failed files: {', '.join(report['failed_files'])}")
+    return '\n'.join(lines)
+
+
+def apply_rows(rows, xml_directory, workers=None, dry_run=False, log_dir=None, index=None, replace=False):
+    """Write rows ({section_id: (title, abstract)}) into the XML files under xml_directory.
+
+    Files are processed on a pool of `workers` processes (one per CPU by default)
+    and written atomically. With dry_run, nothing is written and a unified diff
+    of each change is printed instead. With a section_index.SectionIndex, only
+    the files containing IDs from rows are opened. With replace, previously
+    generated content is updated rather than skipped. Returns the aggregated report.
+    """
+    logger = logging.getLogger(__name__)
+    missing_from_xml = []
+    if index is not None:
+        index.refresh(xml_directory)
+        index.save()
+        xml_files = index.files_for_ids(rows)
+        missing_from_xml = index.missing_ids(rows)
+    else:
+        xml_files = list(find_xml_files(xml_directory))
+    workers = workers or os.cpu_count() or 1
+    logger.info(f"Processing {len(xml_files)} XML files with {workers} workers")
+
+    if workers == 1 or len(xml_files) <= 1:
+        _init_worker(rows, None)
+        file_results = [process_xml_file(file_path, dry_run, replace) for file_path in xml_files]
+    else:
+        chunksize = max(1, len(xml_files) // (workers * 4))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(rows, log_dir)) as executor:
+            file_results = list(executor.map(process_xml_file, xml_files, itertools.repeat(dry_run),
+                                             itertools.repeat(replace), chunksize=chunksize))
+
+    report = {"modified_files": [], "unchanged_files": 0, "failed_files": [], "added": [], "replaced": [],
+              "existing": [], "unmatched": set(), "missing_from_xml": missing_from_xml}
+    for result in file_results:
+        if result["error"]:
+            report["failed_files"].append(result["file"])
+        elif result["added"] or result["replaced"]:
+            report["modified_files"].append(result["file"])
+        else:
+            report["unchanged_files"] += 1
+        report["added"].extend(result["added"])
+        report["replaced"].extend(result["replaced"])
+        report["existing"].extend(result["existing"])
+        report["unmatched"].update(result["unmatched"])
+        if result["diff"]:
+            print(result["diff"], end='')
+    return report
+
+
+def modify_xml_files(csv_path, xml_directory, workers=None, dry_run=False, log_dir=None, index=None):
+    """Add generated titles and abstracts from the CSV at csv_path to every XML file under xml_directory.
+
+    See apply_rows for how files are selected and written. Returns the aggregated report.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(f"Starting XML modification process")
+    logger.info(f"CSV file path: {csv_path}")
+    logger.info(f"XML directory: {xml_directory}")
+
+    try:
+        rows = load_rewrite_rows(csv_path)
+        logger.info(f"Successfully read CSV file. Found {len(rows)} section IDs.")
+
+        report = apply_rows(rows, xml_directory, workers=workers, dry_run=dry_run, log_dir=log_dir, index=index)
+
+        summary = format_report(report, dry_run)
+        print(summary)
+        logger.info(summary)
         logger.info("XML modification process completed successfully")
+        return report
     except Exception as e:
         logger.error(f"Error in modify_xml_files: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
@@ -1,19 +1,28 @@
+import asyncio
+import collections
+import functools
 import json
 import logging
+import os
+import time
 from config import get_config
+from metrics import get_run_metrics
+import clients
+import compact
+import hedging
 from botocore.exceptions import BotoCoreError, ClientError
 
+# Bump whenever a prompt template changes so cached results are regenerated.
+PROMPT_VERSION = "3"
+# Smallest prefix Bedrock caches for most Claude models; PROMPT_CACHE_MIN_TOKENS overrides it.
+PROMPT_CACHE_MIN_TOKENS = 1024
 
-def generate_abstract(bedrock, content, filename):
-    config = get_config()
-    logger = logging.getLogger(f"AbstractGenerator-{filename}")
-    logger.info(f"Generating abstract for {filename}...")
-
-    prompt = f"""Create a concise abstract for a documentation section. The abstract should not exceed 160 characters.
-
-Context: This is a section of a technical documentation website for {config['SERVICE_NAME']}. Filename: {filename}
+ABSTRACT_MAX_CHARS = 160
+# With STREAMING_ENABLED: ~160 characters of abstract with room to finish the sentence, and one 40-70 character title.
+ABSTRACT_STREAM_MAX_TOKENS = 96
+TITLE_STREAM_MAX_TOKENS = 32
 
-Instructions:
+ABSTRACT_GUIDELINES = """Instructions:
 1. Analyze the content thoroughly.
 2. Identify the main topic, key arguments, and significant conclusions.
 3. Create an abstract that:
@@ -35,44 +44,16 @@ Discover how <ServiceName console> components work to <do what the customer need
 
 Good abstract: Learn how to view your quota history and request a quota increase in the AWS Management Console.
 Good abstract: Use allocation strategies to manage how Auto Scaling fulfills On-Demand and Spot capacities from the multiple instance types.
+"""
 
-Important: Provide ONLY the abstract text, without any additional formatting, headings, or metadata.
-
-Markdown Content:
-{content}
-
-Abstract:"""
-
-    body = json.dumps({
-        "max_tokens": 256,
-        "messages": [{"role": "user", "content": prompt}],
-        "anthropic_version": "bedrock-2023-05-31"
-    })
-
-    logger.info("Sending request to Bedrock for abstract generation...")
-    response = bedrock.invoke_model(body=body, modelId=config['BEDROCK_MODEL'])
-    logger.info("Received abstract response from Bedrock.")
-
-    response_body = json.loads(response.get("body").read())
-    abstract = response_body.get("content", [{}])[0].get("text", "").strip()
-    logger.info(f"Generated abstract of {len(abstract)} characters.")
-    return abstract
-
-def generate_new_title(bedrock, original_title, abstract, filename):
-    config = get_config()
-    logger = logging.getLogger(f"TitleGenerator-{filename}")
-    logger.info(f"Generating title for {filename}...")
-
-    prompt = f"""Generate a new title for a {config['SERVICE_NAME']} technical documentation page based on the following guidelines:
-
-    1. Length: 40-70 characters, preferring shorter titles when possible
+TITLE_GUIDELINES = """    1. Length: 40-70 characters, preferring shorter titles when possible
     2. Style: Clear, concise, and appropriate for technical documentation
     3. Focus: Customer-centric, reflecting specific scenarios or tasks
     4. Format: 
        - Avoid using colons (:)
        - Avoid two-part titles (e.g., "Creating an Amazon EKS Cluster: A Step-by-Step Guide")
        - Use the imperative mood. Avoid -ing, such as "Deploying". Use "Deploy"
-    5. Context: Specific to {config['SERVICE_NAME']} services and features
+    5. Context: Specific to {service_name} services and features
 
     Avoid "Managing". 
     - Avoid: Managing Job Dependencies in AWS Batch
@@ -101,7 +82,69 @@ def generate_new_title(bedrock, original_title, abstract, filename):
       New: "Enable Secure Cross-Cluster Connectivity with Amazon VPC Lattice"
     - Original: "Amazon EKS and AWS Local Zones"
       New: "Launch Low-Latency EKS Clusters with AWS Local Zones"
+"""
+
+
+# The rest of the system prompt used with PROMPT_CACHING_ENABLED, which has to be over
+# PROMPT_CACHE_MIN_TOKENS for Bedrock to cache it.
+CONTENT_NOTES = """About the markdown content:
+- Each section comes from one page of the documentation build, with the metadata header at the top of the page removed.
+- Code blocks may be replaced with a placeholder such as [yaml code block, 12 lines omitted], and long tables keep only their header row followed by a placeholder such as [table, 8 rows omitted]. Describe what the section helps the reader do rather than the omitted code or rows.
+- Very long sections end with [content truncated]. Base the abstract and title on the headings and prose that are present.
+- Headings, links and inline code are kept as written. Don't copy markdown syntax, placeholders or link targets into an abstract or title.
+"""
+
+MORE_ABSTRACT_EXAMPLES = """More examples:
+Good abstract: Learn how to create an Amazon S3 bucket and upload your first objects with the AWS CLI.
+Good abstract: Use IAM roles to give applications on Amazon EC2 access to other AWS services without storing credentials.
+Good abstract: Discover how Amazon CloudWatch alarms watch a metric and notify you when it crosses a threshold.
+Avoid: Amazon EKS allows you to run Kubernetes without managing the control plane.
+Instead: Learn how to run Kubernetes on AWS without installing or operating your own control plane.
+Avoid: This page describes the settings that are available for node groups.
+Instead: Configure node group instance types, scaling limits, and labels to match your workloads.
+"""
+
+FINAL_CHECKS = """Before answering, check that:
+- each abstract starts with a verb such as Learn, Use, Create, Configure, or Discover, and is at most 160 characters
+- each title is 40-70 characters, uses the imperative mood, and has no colon
+- both name the service or feature the section is about, using the terms a reader would search for
+"""
+
+RESPONSE_FORMATS = """Response formats. Each request names the one to use:
+- Abstract: only the abstract text, without any additional formatting, headings, or metadata.
+- Title: only the new title, without any additional text or formatting.
+- Abstract and title: only a JSON object with "abstract" and "title" keys, with no other text, for example:
+  {"abstract": "Learn how to ...", "title": "Configure ..."}
+- Several documents: only a JSON object keyed by filename, with no other text, that includes every filename exactly once, for example:
+  {"example.md": {"abstract": "Learn how to ...", "title": "Configure ..."}}
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def title_guidelines(service_name):
+    return TITLE_GUIDELINES.format(service_name=service_name)
+
+
+def build_abstract_prompt(content, filename, config=None):
+    config = config or get_config()
+    return f"""Create a concise abstract for a documentation section. The abstract should not exceed 160 characters.
 
+Context: This is a section of a technical documentation website for {config['SERVICE_NAME']}. Filename: {filename}
+
+{ABSTRACT_GUIDELINES}
+Important: Provide ONLY the abstract text, without any additional formatting, headings, or metadata.
+
+Markdown Content:
+{content}
+
+Abstract:"""
+
+
+def build_title_prompt(original_title, abstract, config=None):
+    config = config or get_config()
+    return f"""Generate a new title for a {config['SERVICE_NAME']} technical documentation page based on the following guidelines:
+
+{title_guidelines(config['SERVICE_NAME'])}
     Input:
     Original Title: {original_title}
     Abstract: {abstract}
@@ -110,26 +153,556 @@ def generate_new_title(bedrock, original_title, abstract, filename):
     Provide only the new title, without any additional text or formatting.
     """
 
-    body = json.dumps({
-        "max_tokens": 256,
+
+def build_batch_prompt(documents, config=None):
+    config = config or get_config()
+    sections = "\n\n".join(
+        f'<document filename="{filename}">\nOriginal Title: {original_title}\n\n{content}\n</document>'
+        for filename, original_title, content in documents
+    )
+    return f"""Create an abstract and a new title for each of the following sections of a technical documentation website for {config['SERVICE_NAME']}.
+
+Abstract guidelines. Each abstract should not exceed 160 characters.
+
+{ABSTRACT_GUIDELINES}
+Title guidelines. Base each title on the section's abstract and original title.
+
+{title_guidelines(config['SERVICE_NAME'])}
+Documents:
+{sections}
+
+Output:
+Respond with ONLY a JSON object keyed by filename, with no other text. Include every filename exactly once, for example:
+{{"example.md": {{"abstract": "Learn how to ...", "title": "Configure ..."}}}}"""
+
+
+def build_fused_prompt(content, original_title, filename, config=None):
+    config = config or get_config()
+    return f"""Create a concise abstract and a new title for a documentation section.
+
+Context: This is a section of a technical documentation website for {config['SERVICE_NAME']}. Filename: {filename}
+
+Abstract guidelines. The abstract should not exceed 160 characters.
+
+{ABSTRACT_GUIDELINES}
+Title guidelines. Base the title on the abstract and the original title.
+
+{title_guidelines(config['SERVICE_NAME'])}
+Original Title: {original_title}
+
+Markdown Content:
+{content}
+
+Output:
+Respond with ONLY a JSON object with "abstract" and "title" keys, with no other text, for example:
+{{"abstract": "Learn how to ...", "title": "Configure ..."}}"""
+
+
+@functools.lru_cache(maxsize=None)
+def build_system_prefix(service_name):
+    """Guidelines shared by every abstract and title request, for the cacheable system prompt.
+
+    Built once per service name and reused byte for byte, so the service can serve it from its prompt cache.
+    """
+    return f"""You write abstracts and titles for sections of a technical documentation website for {service_name}.
+
+{CONTENT_NOTES}
+Abstract guidelines. An abstract should not exceed 160 characters.
+
+{ABSTRACT_GUIDELINES}
+{MORE_ABSTRACT_EXAMPLES}
+Title guidelines. Base a title on the section's abstract and original title.
+
+{title_guidelines(service_name)}
+{FINAL_CHECKS}
+{RESPONSE_FORMATS}"""
+
+
+def check_system_prefix(service_name, min_tokens=PROMPT_CACHE_MIN_TOKENS):
+    """Warn, and return False, if the system prefix is estimated below the size Bedrock will cache."""
+    tokens = compact.estimate_tokens(build_system_prefix(service_name))
+    if tokens < min_tokens:
+        logging.getLogger(__name__).warning(
+            f"The cached system prompt for {service_name} is ~{tokens} tokens, below the {min_tokens}-token minimum "
+            f"for prompt caching, so Bedrock won't cache it")
+        return False
+    return True
+
+
+def build_system_blocks(service_name):
+    return [{"type": "text", "text": build_system_prefix(service_name), "cache_control": {"type": "ephemeral"}}]
+
+
+def build_abstract_suffix(content, filename):
+    return f"""Create a concise abstract for a documentation section, following the abstract guidelines.
+
+Filename: {filename}
+
+Use the Abstract response format.
+
+Markdown Content:
+{content}
+
+Abstract:"""
+
+
+def build_title_suffix(original_title, abstract):
+    return f"""Generate a new title for a documentation page, following the title guidelines.
+
+Input:
+Original Title: {original_title}
+Abstract: {abstract}
+
+Use the Title response format."""
+
+
+def build_fused_suffix(content, original_title, filename):
+    return f"""Create a concise abstract and a new title for a documentation section, following the abstract and title guidelines.
+
+Filename: {filename}
+Original Title: {original_title}
+
+Markdown Content:
+{content}
+
+Use the Abstract and title response format: a JSON object with "abstract" and "title" keys."""
+
+
+def build_batch_suffix(documents):
+    sections = "\n\n".join(
+        f'<document filename="{filename}">\nOriginal Title: {original_title}\n\n{content}\n</document>'
+        for filename, original_title, content in documents
+    )
+    return f"""Create an abstract and a new title for each of the following documentation sections, following the abstract and title guidelines.
+
+Documents:
+{sections}
+
+Use the Several documents response format, including every filename exactly once."""
+
+
+def prompt_caching_enabled(config=None):
+    return (config or get_config()).get('PROMPT_CACHING_ENABLED', False)
+
+
+def prompt_version(config=None):
+    """PROMPT_VERSION, qualified by every setting that changes the prompt or its output.
+
+    Part of the result cache key, so results generated with different settings
+    are cached apart.
+    """
+    config = config or get_config()
+    parts = [PROMPT_VERSION]
+    if prompt_caching_enabled(config):
+        parts.append("cached")
+    if config.get('COMPACTION_ENABLED', True):
+        parts.append(f"compact{config.get('PROMPT_TOKEN_BUDGET', 6000)}")
+    if config.get('FUSED_GENERATION_ENABLED', False):
+        parts.append("fused")
+    if config.get('STREAMING_ENABLED', False):
+        parts.append("stream")
+    return '-'.join(parts)
+
+
+def build_request_body(prompt, max_tokens=256, system=None):
+    request = {
+        "max_tokens": max_tokens,
         "messages": [{"role": "user", "content": prompt}],
         "anthropic_version": "bedrock-2023-05-31"
-    })
+    }
+    if system:
+        request["system"] = system
+    return json.dumps(request)
 
-    logger.info("Sending request to Bedrock for title generation...")
+
+def build_abstract_request(content, filename, max_tokens=256, config=None):
+    config = config or get_config()
+    if prompt_caching_enabled(config):
+        return build_request_body(build_abstract_suffix(content, filename), max_tokens,
+                                  build_system_blocks(config['SERVICE_NAME']))
+    return build_request_body(build_abstract_prompt(content, filename, config), max_tokens)
+
+
+def build_title_request(original_title, abstract, max_tokens=256, config=None):
+    config = config or get_config()
+    if prompt_caching_enabled(config):
+        return build_request_body(build_title_suffix(original_title, abstract), max_tokens,
+                                  build_system_blocks(config['SERVICE_NAME']))
+    return build_request_body(build_title_prompt(original_title, abstract, config), max_tokens)
+
+
+def build_fused_request(content, original_title, filename, config=None):
+    config = config or get_config()
+    if prompt_caching_enabled(config):
+        return build_request_body(build_fused_suffix(content, original_title, filename),
+                                  system=build_system_blocks(config['SERVICE_NAME']))
+    return build_request_body(build_fused_prompt(content, original_title, filename, config))
+
+
+def build_batch_request(documents, max_tokens, config=None):
+    config = config or get_config()
+    if prompt_caching_enabled(config):
+        return build_request_body(build_batch_suffix(documents), max_tokens,
+                                  system=build_system_blocks(config['SERVICE_NAME']))
+    return build_request_body(build_batch_prompt(documents, config), max_tokens)
+
+
+def parse_response_text(response_body):
+    return response_body.get("content", [{}])[0].get("text", "").strip()
+
+
+# One Bedrock request of a generation step: the request body, the metrics stage,
+# is_complete(text) when the response is streamed (None otherwise), and finish(text),
+# which turns the response text into the step's result. Building and finishing
+# steps is shared by both engines; only sending them differs.
+ModelCall = collections.namedtuple('ModelCall', ['body', 'stage', 'is_complete', 'finish'])
+
+
+def record_response(stage, start, raw_body):
+    """Parse a response body, recording its latency and token usage under `stage`."""
+    response_body = json.loads(raw_body)
+    run_metrics = get_run_metrics()
+    run_metrics.record_stage(stage, time.perf_counter() - start)
+    run_metrics.record_usage(stage, response_body.get("usage"))
+    return response_body
+
+
+def invoke_model(bedrock, body, stage, config=None):
+    """Call Bedrock and return the parsed response body, recording latency and token usage under `stage`."""
+    config = config or get_config()
+    start = time.perf_counter()
     response = bedrock.invoke_model(body=body, modelId=config['BEDROCK_MODEL'])
-    logger.info("Received title response from Bedrock.")
+    return record_response(stage, start, response.get("body").read())
+
+
+async def invoke_model_async(bedrock, body, stage, config=None):
+    config = config or get_config()
+    start = time.perf_counter()
+    response = await bedrock.invoke_model(body=body, modelId=config['BEDROCK_MODEL'])
+    return record_response(stage, start, await clients.read_body(response.get("body")))
+
+
+class StreamReader:
+    """Collects the text and token usage of a streamed response, one event at a time.
+
+    Time to first token is recorded under "<stage>_ttft" next to the end-to-end
+    latency and token usage.
+    """
+
+    def __init__(self, stage, is_complete):
+        self.stage = stage
+        self.is_complete = is_complete
+        self.start = time.perf_counter()
+        self.parts = []
+        self.usage = {}
+        self.stopped_early = False
+
+    def add(self, event):
+        """Take one event; returns True once is_complete(text) is true and reading should stop."""
+        error = clients.stream_error(event)
+        if error is not None:
+            raise error
+        hedging.check_deadline()
+        payload = json.loads(event["chunk"]["bytes"])
+        if payload["type"] == "message_start":
+            self.usage.update(payload["message"].get("usage", {}))
+        elif payload["type"] == "message_delta":
+            self.usage.update(payload.get("usage", {}))
+        elif payload["type"] == "content_block_delta":
+            if not self.parts:
+                get_run_metrics().record_stage(f"{self.stage}_ttft", time.perf_counter() - self.start)
+            self.parts.append(payload["delta"].get("text", ""))
+            if self.is_complete(''.join(self.parts)):
+                self.stopped_early = True
+        return self.stopped_early
+
+    def text(self):
+        """The text received, recording the stage's latency and usage."""
+        run_metrics = get_run_metrics()
+        text = ''.join(self.parts)
+        if self.stopped_early:
+            # The output token count only arrives after the last chunk, so estimate what was received.
+            self.usage["output_tokens"] = compact.estimate_tokens(text)
+            run_metrics.increment("streams_stopped_early")
+        run_metrics.record_stage(self.stage, time.perf_counter() - self.start)
+        run_metrics.record_usage(self.stage, self.usage)
+        return text
+
+
+def invoke_model_stream(bedrock, body, stage, is_complete, config=None):
+    """Stream a response with invoke_model_with_response_stream and return its text.
+
+    Reading stops as soon as is_complete(text) is true.
+    """
+    config = config or get_config()
+    reader = StreamReader(stage, is_complete)
+    hedging.check_deadline()
+    response = bedrock.invoke_model_with_response_stream(body=body, modelId=config['BEDROCK_MODEL'])
+    stream = response.get("body")
+    try:
+        for event in stream:
+            if reader.add(event):
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return reader.text()
+
+
+async def invoke_model_stream_async(bedrock, body, stage, is_complete, config=None):
+    """invoke_model_stream for the async engine, where bedrock is an async_generate.BoundedAsyncClient.
+
+    A blocking client's event stream is read on the client's worker threads; an
+    async client's is read on the event loop, holding one in-flight slot throughout.
+    """
+    if not bedrock.is_async:
+        return await bedrock.run_blocking(invoke_model_stream, bedrock.client, body, stage, is_complete, config)
+
+    config = config or get_config()
+    reader = StreamReader(stage, is_complete)
+    hedging.check_deadline()
+    async with bedrock.slot():
+        response = await bedrock.client.invoke_model_with_response_stream(body=body, modelId=config['BEDROCK_MODEL'])
+        stream = response.get("body")
+        try:
+            async for event in stream:
+                if reader.add(event):
+                    break
+        finally:
+            await clients.close_stream(stream)
+    return reader.text()
+
+
+def request(bedrock, call, config=None):
+    """Send a ModelCall and return its finished result."""
+    if call.is_complete:
+        text = invoke_model_stream(bedrock, call.body, call.stage, call.is_complete, config)
+    else:
+        text = parse_response_text(invoke_model(bedrock, call.body, call.stage, config))
+    return call.finish(text)
+
+
+async def request_async(bedrock, call, config=None):
+    if call.is_complete:
+        text = await invoke_model_stream_async(bedrock, call.body, call.stage, call.is_complete, config)
+    else:
+        text = parse_response_text(await invoke_model_async(bedrock, call.body, call.stage, config))
+    return call.finish(text)
+
+
+def abstract_complete(text):
+    """True once a streamed abstract has ended its paragraph or run past ABSTRACT_MAX_CHARS."""
+    text = text.strip()
+    return '\n\n' in text or len(text) > ABSTRACT_MAX_CHARS
+
+
+def title_complete(text):
+    """True once a streamed title has a complete first line."""
+    return '\n' in text.lstrip()
+
+
+def trim_streamed_abstract(text):
+    """Cut a streamed abstract to its first paragraph and, if that is longer than ABSTRACT_MAX_CHARS,
+    to the last sentence (or else word) that fits."""
+    text = text.strip().split('\n\n')[0].strip()
+    if len(text) <= ABSTRACT_MAX_CHARS:
+        return text
+    head = text[:ABSTRACT_MAX_CHARS]
+    if head.endswith('.'):
+        return head
+    sentence_end = head.rfind('. ')
+    if sentence_end > 0:
+        return head[:sentence_end + 1]
+    return head.rsplit(' ', 1)[0]
+
+
+def trim_streamed_title(text):
+    return text.strip().split('\n')[0].strip()
+
+
+def parse_json_object(text):
+    """Parse the first JSON object in a model response, tolerating surrounding prose or code fences."""
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        raise ValueError("No JSON object found in response")
+    parsed = json.loads(text[start:end + 1])
+    if not isinstance(parsed, dict):
+        raise ValueError("Response JSON is not an object")
+    return parsed
+
+
+def abstract_call(content, filename, config=None):
+    config = config or get_config()
+    logger = logging.LoggerAdapter(logging.getLogger("AbstractGenerator"), {"doc": filename})
+    logger.info(f"Generating abstract for {filename}...")
+    streaming = config.get('STREAMING_ENABLED', False)
+    if streaming:
+        body = build_abstract_request(content, filename, ABSTRACT_STREAM_MAX_TOKENS, config)
+    else:
+        body = build_abstract_request(content, filename, config=config)
+    logger.info("Sending request to Bedrock for abstract generation...")
+
+    def finish(text):
+        abstract = trim_streamed_abstract(text) if streaming else text
+        logger.info("Received abstract response from Bedrock.")
+        logger.info(f"Generated abstract of {len(abstract)} characters.")
+        return abstract
+
+    return ModelCall(body, "abstract", abstract_complete if streaming else None, finish)
+
+
+def title_call(original_title, abstract, filename, config=None):
+    config = config or get_config()
+    logger = logging.LoggerAdapter(logging.getLogger("TitleGenerator"), {"doc": filename})
+    logger.info(f"Generating title for {filename}...")
+    streaming = config.get('STREAMING_ENABLED', False)
+    if streaming:
+        body = build_title_request(original_title, abstract, TITLE_STREAM_MAX_TOKENS, config)
+    else:
+        body = build_title_request(original_title, abstract, config=config)
+    logger.info("Sending request to Bedrock for title generation...")
+
+    def finish(text):
+        new_title = trim_streamed_title(text) if streaming else text
+        logger.info("Received title response from Bedrock.")
+        logger.info(f"Generated new title: {new_title}")
+        return new_title
+
+    return ModelCall(body, "title", title_complete if streaming else None, finish)
+
+
+def parse_abstract_and_title(entry):
+    """Return (abstract, title) from a parsed {"abstract", "title"} object, or None if either is missing."""
+    if not isinstance(entry, dict):
+        return None
+    abstract = entry.get("abstract")
+    title = entry.get("title")
+    if isinstance(abstract, str) and isinstance(title, str) and abstract.strip() and title.strip():
+        return abstract.strip(), title.strip()
+    return None
+
+
+def fused_call(content, original_title, filename, config=None):
+    """A single request for the abstract and title. Its finish raises ValueError if the output can't be parsed."""
+    logger = logging.LoggerAdapter(logging.getLogger("FusedGenerator"), {"doc": filename})
+    logger.info(f"Generating abstract and title for {filename} in one request...")
+
+    def finish(text):
+        entry = parse_abstract_and_title(parse_json_object(text))
+        if entry is None:
+            raise ValueError("Response is missing the abstract or title")
+        logger.info(f"Generated abstract of {len(entry[0])} characters and title: {entry[1]}")
+        return entry
+
+    return ModelCall(build_fused_request(content, original_title, filename, config), "fused", None, finish)
+
+
+def batch_call(documents, config=None):
+    """A single request for several (filename, original_title, content) documents.
+
+    Its finish returns a dict of filename -> {"abstract": ..., "title": ...}
+    holding only the well-formed entries.
+    """
+    logger = logging.getLogger("BatchGenerator")
+    filenames = [filename for filename, _, _ in documents]
+    logger.info(f"Generating abstracts and titles for batch of {len(documents)} files: {', '.join(filenames)}")
+
+    def finish(text):
+        parsed = parse_json_object(text)
+        generated = {}
+        for filename in filenames:
+            entry = parse_abstract_and_title(parsed.get(filename))
+            if entry:
+                generated[filename] = {"abstract": entry[0], "title": entry[1]}
+        logger.info(f"Batch returned usable results for {len(generated)} of {len(documents)} files.")
+        return generated
+
+    # Roughly 60 output tokens per abstract/title pair plus JSON overhead.
+    body = build_batch_request(documents, max_tokens=min(4096, 128 * len(documents)), config=config)
+    return ModelCall(body, "batch", None, finish)
+
+
+def generate_abstract(bedrock, content, filename, config=None):
+    return request(bedrock, abstract_call(content, filename, config), config)
+
+
+def generate_new_title(bedrock, original_title, abstract, filename, config=None):
+    return request(bedrock, title_call(original_title, abstract, filename, config), config)
 
-    response_body = json.loads(response.get("body").read())
-    new_title = response_body.get("content", [{}])[0].get("text", "").strip()
-    logger.info(f"Generated new title: {new_title}")
-    return new_title
 
+def generate_fused(bedrock, content, original_title, filename, config=None):
+    """Generate the abstract and title with a single request. Raises ValueError if the output can't be parsed."""
+    return request(bedrock, fused_call(content, original_title, filename, config), config)
 
-def validate_bedrock_connection(bedrock_client, model_id):
+
+def generate_batch(bedrock, documents, config=None):
+    """Generate abstracts and titles for several (filename, original_title, content) documents in one call.
+
+    Returns a dict of filename -> {"abstract": ..., "title": ...} holding only the
+    well-formed entries; callers fall back to the single-file path for the rest.
+    """
+    return request(bedrock, batch_call(documents, config), config)
+
+
+def log_fused_fallback(filename, error):
+    logging.LoggerAdapter(logging.getLogger("FusedGenerator"), {"doc": filename}).warning(
+        f"Fused generation failed for {filename}, falling back to separate requests: {str(error)}")
+
+
+def generate_abstract_and_title(bedrock, content, original_title, filename, config=None):
+    """Return (abstract, title), using one fused request when FUSED_GENERATION_ENABLED is set.
+
+    Falls back to the abstract -> title chain when the fused output can't be parsed.
+    """
+    config = config or get_config()
+    if config.get('FUSED_GENERATION_ENABLED', False):
+        try:
+            return request(bedrock, fused_call(content, original_title, filename, config), config)
+        except ValueError as e:
+            log_fused_fallback(filename, e)
+
+    abstract = request(bedrock, abstract_call(content, filename, config), config)
+    new_title = request(bedrock, title_call(original_title, abstract, filename, config), config)
+    return abstract, new_title
+
+
+async def generate_abstract_and_title_async(bedrock, content, original_title, filename, config=None):
+    config = config or get_config()
+    if config.get('FUSED_GENERATION_ENABLED', False):
+        try:
+            return await request_async(bedrock, fused_call(content, original_title, filename, config), config)
+        except ValueError as e:
+            log_fused_fallback(filename, e)
+
+    abstract = await request_async(bedrock, abstract_call(content, filename, config), config)
+    new_title = await request_async(bedrock, title_call(original_title, abstract, filename, config), config)
+    return abstract, new_title
+
+
+async def _invoke_test_request_async(bedrock_client, body, model_id):
+    response = await bedrock_client.invoke_model(body=body, modelId=model_id)
+    return response, await clients.read_body(response['body'])
+
+
+def _invoke_test_request(bedrock_client, body, model_id):
+    """Send the validation request and return (response, raw body), running it on an event loop for an async client."""
+    if clients.is_async_client(bedrock_client):
+        return asyncio.run(_invoke_test_request_async(bedrock_client, body, model_id))
+    response = bedrock_client.invoke_model(body=body, modelId=model_id)
+    return response, response['body'].read()
+
+
+def validate_bedrock_connection(bedrock_client, model_id, check_cache=None):
     logger = logging.getLogger(__name__)
+    # The validation request is billed, so a success is remembered per profile, region and model.
+    cache_key = f"bedrock:{os.environ.get('AWS_PROFILE', '')}:{os.environ.get('AWS_REGION', '')}:{model_id}"
+    if check_cache is not None and check_cache.get(cache_key):
+        logger.info(f"Bedrock connection for {model_id} validated recently, skipping the test request.")
+        return
+
     logger.info("Validating Bedrock connection...")
-    config = get_config()
 
     try:
         # Prepare a simple prompt for the test call
@@ -141,16 +714,18 @@ def validate_bedrock_connection(bedrock_client, model_id):
         })
 
         # Make the test call to Bedrock
-        response = bedrock_client.invoke_model(body=body, modelId=config['BEDROCK_MODEL'])
+        response, raw_body = _invoke_test_request(bedrock_client, body, model_id)
 
         # Check if the response is valid
         if response['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError(f"Unexpected status code: {response['ResponseMetadata']['HTTPStatusCode']}")
 
         # Try to parse the response body
-        response_body = json.loads(response['body'].read())
+        response_body = json.loads(raw_body)
 
         logger.info("Bedrock connection validated successfully.")
+        if check_cache is not None:
+            check_cache.put(cache_key)
     except (BotoCoreError, ClientError) as e:
         logger.error(f"AWS or Bedrock API error: {str(e)}")
         raise
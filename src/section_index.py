@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import re
+import modify
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+# modify.SECTION_PATTERN over raw bytes, so offsets are byte offsets into the file.
+SECTION_PATTERN_BYTES = re.compile(modify.SECTION_PATTERN.pattern.encode('utf-8'))
+
+
+class SectionIndex:
+    """Persisted map of <section id> values to the XML files (and byte offsets) that contain them.
+
+    Each file entry records the mtime and size it was scanned at, so refresh()
+    only re-reads files that changed since the index was saved.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self._files_by_id = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    self.files = data.get('files', {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable section index {path}: {e}")
+
+    def refresh(self, xml_directory):
+        scanned = reused = 0
+        current = {}
+        for file_path in modify.find_xml_files(xml_directory):
+            stat = os.stat(file_path)
+            entry = self.files.get(file_path)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                reused += 1
+            else:
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                entry = {
+                    'mtime': stat.st_mtime,
+                    'size': stat.st_size,
+                    'sections': [[match.group(1).decode('utf-8', errors='replace'), match.start()]
+                                 for match in SECTION_PATTERN_BYTES.finditer(data)]
+                }
+                scanned += 1
+            current[file_path] = entry
+
+        removed = len(set(self.files) - set(current))
+        self.files = current
+        self._files_by_id = None
+        logger.info(f"Section index refreshed: {scanned} files scanned, {reused} unchanged, {removed} removed")
+        return scanned, reused, removed
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        modify.write_atomic(self.path, json.dumps({'version': INDEX_VERSION, 'files': self.files}))
+
+    def files_by_id(self):
+        if self._files_by_id is None:
+            self._files_by_id = {}
+            for file_path, entry in self.files.items():
+                for section_id, _ in entry['sections']:
+                    self._files_by_id.setdefault(section_id, set()).add(file_path)
+        return self._files_by_id
+
+    def files_for_ids(self, section_ids):
+        files_by_id = self.files_by_id()
+        matched = set()
+        for section_id in section_ids:
+            matched.update(files_by_id.get(section_id, ()))
+        return sorted(matched)
+
+    def missing_ids(self, section_ids):
+        files_by_id = self.files_by_id()
+        return sorted(section_id for section_id in section_ids if section_id not in files_by_id)
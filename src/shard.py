@@ -0,0 +1,66 @@
+import argparse
+import csv
+import logging
+import os
+import zlib
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(value):
+    """Parse "INDEX/COUNT" (e.g. "0/4") into (index, count), for use as an argparse type."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}', expected INDEX/COUNT such as 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}', INDEX must be between 0 and COUNT-1")
+    return index, count
+
+
+def shard_of(filename, count):
+    # crc32 rather than hash(), which is randomized per process.
+    return zlib.crc32(filename.encode('utf-8')) % count
+
+
+def in_shard(file_path, shard):
+    index, count = shard
+    return shard_of(os.path.basename(file_path), count) == index
+
+
+def shard_output_path(output_file, shard):
+    index, count = shard
+    base, ext = os.path.splitext(output_file)
+    return f"{base}.shard-{index}-of-{count}{ext}"
+
+
+def merge_shard_csvs(csv_paths, output_file, expected_files=None):
+    """Combine per-shard CSVs into output_file.
+
+    Rows for a file name already seen in an earlier CSV are reported and dropped.
+    If expected_files is given, file names missing from every shard are reported.
+    Returns (rows_written, duplicates, missing).
+    """
+    seen = set()
+    duplicates = []
+
+    def merged_rows():
+        for csv_path in csv_paths:
+            with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    filename = row.get('File Name')
+                    if filename in seen:
+                        duplicates.append(filename)
+                        logger.warning(f"Duplicate result for {filename} in {csv_path}, keeping the first")
+                        continue
+                    seen.add(filename)
+                    yield row
+
+    utils.save_to_csv(merged_rows(), output_file)
+
+    missing = sorted(set(expected_files) - seen) if expected_files is not None else []
+    if missing:
+        logger.warning(f"{len(missing)} markdown files have no result in any shard: {', '.join(missing)}")
+    logger.info(f"Merged {len(seen)} results from {len(csv_paths)} shard files into {output_file}")
+    return len(seen), duplicates, missing
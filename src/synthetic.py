@@ -0,0 +1,122 @@
+"""Synthetic markdown and DocBook XML trees for offline benchmarks.
+
+The markdown mimics the guide's markdown build: a dashed metadata header, an h1
+with an anchor, prose, code fences and tables. The XML mimics the DocBook
+sources, with one <section id="..."> per markdown file so a generation CSV for
+the markdown tree applies to the XML tree.
+"""
+import os
+import random
+import utils
+
+WORDS = ("cluster node pod service container image deploy configure scale monitor network "
+         "security policy role access account region endpoint instance volume storage "
+         "update version upgrade workload namespace metric alarm log event quota limit").split()
+
+SUBDIRECTORY_SIZE = 200
+
+
+def section_id(index):
+    return f"bench-section-{index}"
+
+
+def _sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def _paragraph(rng, sentences=4):
+    return ' '.join(_sentence(rng, rng.randint(8, 18)) for _ in range(sentences))
+
+
+def render_markdown(index, target_chars, rng):
+    parts = [
+        "--------",
+        f"Generated page {index}",
+        "--------",
+        f"# {_sentence(rng, 5)[:-1].title()} <a name=\"{section_id(index)}\"></a>",
+        "",
+        _paragraph(rng),
+        "",
+    ]
+    size = sum(len(part) + 1 for part in parts)
+    block = 0
+    while size < target_chars:
+        block += 1
+        if block % 4 == 1:
+            lines = [f"## {_sentence(rng, 4)[:-1].title()}", ""]
+        elif block % 4 == 2:
+            lines = ["```yaml"] + [f"{rng.choice(WORDS)}: {rng.choice(WORDS)}" for _ in range(rng.randint(3, 15))] + ["```", ""]
+        elif block % 4 == 3:
+            lines = ["| Name | Description |", "| --- | --- |"]
+            lines += [f"| {rng.choice(WORDS)} | {_sentence(rng, 6)} |" for _ in range(rng.randint(2, 8))] + [""]
+        else:
+            lines = [_paragraph(rng), ""]
+        parts.extend(lines)
+        size += sum(len(line) + 1 for line in lines)
+    return '\n'.join(parts)
+
+
+def generate_markdown_tree(directory, files, mean_chars=4000, seed=0):
+    """Write `files` markdown pages under directory, in subdirectories of SUBDIRECTORY_SIZE files.
+
+    Page sizes are lognormal around mean_chars so a few pages are much larger
+    than the rest, as in real guides. Returns the list of paths written.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for index in range(files):
+        subdirectory = os.path.join(directory, f"part-{index // SUBDIRECTORY_SIZE}")
+        os.makedirs(subdirectory, exist_ok=True)
+        path = os.path.join(subdirectory, f"{section_id(index)}.md")
+        target_chars = int(mean_chars * rng.lognormvariate(0, 0.6))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(render_markdown(index, target_chars, rng))
+        paths.append(path)
+    return paths
+
+
+def render_xml_section(index, rng):
+    return (f'  <section id="{section_id(index)}" role="topic">\n'
+            f'    <info><titleabbrev>{_sentence(rng, 3)[:-1]}</titleabbrev></info>\n'
+            f'    <title>{_sentence(rng, 5)[:-1].title()}</title>\n'
+            f'    <para>{_paragraph(rng)}</para>\n'
+            f'    <para>{_paragraph(rng)}</para>\n'
+            f'  </section>\n')
+
+
+def generate_xml_tree(directory, files, sections_per_file=10, seed=0):
+    """Write `files` DocBook chapters under directory, numbering sections consecutively.
+
+    Returns the number of sections written; their IDs are section_id(0) up to
+    section_id(count - 1).
+    """
+    rng = random.Random(seed)
+    count = 0
+    for file_index in range(files):
+        subdirectory = os.path.join(directory, f"part-{file_index // SUBDIRECTORY_SIZE}")
+        os.makedirs(subdirectory, exist_ok=True)
+        sections = []
+        for _ in range(sections_per_file):
+            sections.append(render_xml_section(count, rng))
+            count += 1
+        with open(os.path.join(subdirectory, f"chapter-{file_index}.xml"), 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    f'<chapter xmlns="http://docbook.org/ns/docbook" version="5.0" xml:id="chapter-{file_index}">\n'
+                    f'  <title>Chapter {file_index}</title>\n'
+                    + ''.join(sections) +
+                    '</chapter>\n')
+    return count
+
+
+def write_rewrite_csv(path, section_count):
+    """Write a generation CSV with a row for section_id(0) .. section_id(section_count - 1)."""
+    utils.save_to_csv(({
+        'File Name': f"{section_id(index)}.md",
+        'Existing Title': f"Section {index}",
+        'Existing Title Length': len(f"Section {index}"),
+        'AI Generated Abstract': f"Learn how to use section {index} to get work done.",
+        'AI Generated Title': f"Use Section {index}",
+        'AI Generated Title Length': len(f"Use Section {index}"),
+        'First Paragraph': "",
+    } for index in range(section_count)), path)
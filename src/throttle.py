@@ -0,0 +1,402 @@
+import asyncio
+import io
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+import clients
+import compact
+
+logger = logging.getLogger(__name__)
+
+# The last is how a throttle arrives inside a response stream.
+THROTTLE_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException', 'throttlingException')
+# How often a coroutine waiting for a concurrency slot checks again; threads wait on the condition instead.
+ASYNC_SLOT_POLL_SECONDS = 0.01
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute` units per minute, holding at most one minute's worth."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (0 if they are available now)."""
+        self._refill(now)
+        # A single request larger than the bucket would otherwise wait forever.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        # Allowed to go negative so that under-estimated requests are paid back later.
+        self.tokens -= amount
+
+
+class RateController:
+    """Shared request/token budget with AIMD concurrency control.
+
+    Every Bedrock call takes a concurrency slot plus one request and its estimated
+    tokens from the per-minute buckets. A throttle halves the concurrency limit
+    (at most once per cooldown so a burst of throttles counts as one signal); each
+    full window of `limit` successful calls raises it by one.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_concurrency=20,
+                 min_concurrency=1, decrease_factor=0.5, cooldown_seconds=5.0):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+
+        self.in_flight = 0
+        self.successes_since_increase = 0
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.throttles = 0
+        self._condition = threading.Condition()
+
+    def _take(self, estimated_tokens):
+        """Take a slot and budget if they are available now, returning 0.
+
+        Otherwise returns the seconds until the budget refills, or None while
+        every slot is taken. Called with the condition held.
+        """
+        if self.in_flight >= int(self.limit):
+            return None
+
+        now = time.monotonic()
+        wait = 0.0
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.wait_time(1, now))
+        if self.token_bucket:
+            wait = max(wait, self.token_bucket.wait_time(estimated_tokens, now))
+        if wait > 0:
+            return wait
+
+        if self.request_bucket:
+            self.request_bucket.consume(1)
+        if self.token_bucket:
+            self.token_bucket.consume(estimated_tokens)
+        self.in_flight += 1
+        self.requests += 1
+        return 0
+
+    def acquire(self, estimated_tokens):
+        with self._condition:
+            while True:
+                wait = self._take(estimated_tokens)
+                if wait == 0:
+                    return
+                # Without a timeout, wait for a release.
+                self._condition.wait(timeout=wait)
+
+    async def acquire_async(self, estimated_tokens):
+        """acquire for coroutines, sleeping on the event loop rather than blocking it on the condition."""
+        while True:
+            with self._condition:
+                wait = self._take(estimated_tokens)
+            if wait == 0:
+                return
+            await asyncio.sleep(ASYNC_SLOT_POLL_SECONDS if wait is None else wait)
+
+    def try_acquire(self, estimated_tokens):
+        """Take a slot and budget only if they are available right now; returns whether it did."""
+        with self._condition:
+            return self._take(estimated_tokens) == 0
+
+    def release(self, throttled=False, token_correction=0):
+        with self._condition:
+            self.in_flight -= 1
+            if self.token_bucket and token_correction:
+                self.token_bucket.consume(token_correction)
+
+            if throttled:
+                self.throttles += 1
+                now = time.monotonic()
+                if now - self.last_decrease >= self.cooldown_seconds:
+                    self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+                    logger.warning(f"Bedrock throttled, reducing concurrency to {int(self.limit)}")
+                self.successes_since_increase = 0
+            else:
+                self.successes_since_increase += 1
+                if self.successes_since_increase >= int(self.limit) and self.limit < self.max_concurrency:
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+                    self.successes_since_increase = 0
+                    logger.debug(f"Increasing Bedrock concurrency to {int(self.limit)}")
+            self._condition.notify_all()
+
+    def summary(self):
+        return (f"Rate controller: {self.requests} requests, {self.throttles} throttled, "
+                f"final concurrency {int(self.limit)}/{self.max_concurrency}")
+
+
+def is_throttle_error(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+
+
+def estimate_request_tokens(body):
+    """Rough input + output token estimate for an Anthropic messages request body."""
+    request = json.loads(body)
+    return compact.estimate_tokens(body) + request.get('max_tokens', 0)
+
+
+def token_correction(raw_body, estimated_tokens):
+    """Difference between a response's reported token usage and the estimate paid up front (0 if unknown)."""
+    try:
+        usage = json.loads(raw_body).get('usage', {})
+    except ValueError:
+        return 0
+    actual_tokens = usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
+    return actual_tokens - estimated_tokens if actual_tokens else 0
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    # Full jitter keeps retrying workers from re-synchronising.
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class ThrottledBedrockClient:
+    """Routes invoke_model through a RateController, retrying throttles with jittered backoff."""
+
+    def __init__(self, client, controller, max_retries=8, base_delay=1.0, max_delay=60.0):
+        self.client = client
+        self.controller = controller
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _invoke(self, method, kwargs, estimated_tokens):
+        """Call `method` with a concurrency slot held, retrying throttles. The slot is still held on return."""
+        for attempt in range(self.max_retries + 1):
+            self.controller.acquire(estimated_tokens)
+            try:
+                return method(**kwargs)
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                self.controller.release(throttled=throttled)
+                if not throttled or attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                logger.info(f"Throttled by Bedrock, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+
+    def invoke_model(self, **kwargs):
+        estimated_tokens = estimate_request_tokens(kwargs.get('body', '{}'))
+        response = self._invoke(self.client.invoke_model, kwargs, estimated_tokens)
+
+        # Read the body here to settle the token budget against the real usage.
+        correction = 0
+        try:
+            raw_body = response['body'].read()
+            response['body'] = io.BytesIO(raw_body)
+            correction = token_correction(raw_body, estimated_tokens)
+        finally:
+            self.controller.release(token_correction=correction)
+        return response
+
+    def _start_stream(self, **kwargs):
+        """Start a response stream and read its first event, so a throttle sent in the stream is raised, and retried, here.
+
+        Returns (response, the stream's events including the first).
+        """
+        response = self.client.invoke_model_with_response_stream(**kwargs)
+        stream = response['body']
+        events = iter(stream)
+        try:
+            first = next(events, None)
+            error = None if first is None else clients.stream_error(first)
+            if error is not None:
+                raise error
+        except BaseException:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+            raise
+        return response, events if first is None else itertools.chain([first], events)
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        # The slot is held until the caller finishes reading the stream or closes it.
+        estimated_tokens = estimate_request_tokens(kwargs.get('body', '{}'))
+        response, events = self._invoke(self._start_stream, kwargs, estimated_tokens)
+        response['body'] = ReleasingEventStream(response['body'], self.controller, estimated_tokens, events)
+        return response
+
+
+class AsyncThrottledBedrockClient(ThrottledBedrockClient):
+    """ThrottledBedrockClient for a client whose methods are coroutines; waits and retries on the event loop."""
+
+    async def _invoke(self, method, kwargs, estimated_tokens):
+        for attempt in range(self.max_retries + 1):
+            await self.controller.acquire_async(estimated_tokens)
+            try:
+                return await method(**kwargs)
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                self.controller.release(throttled=throttled)
+                if not throttled or attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                logger.info(f"Throttled by Bedrock, retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Cancelled, e.g. a hedge that lost or a deadline.
+                self.controller.release()
+                raise
+
+    async def invoke_model(self, **kwargs):
+        estimated_tokens = estimate_request_tokens(kwargs.get('body', '{}'))
+        response = await self._invoke(self.client.invoke_model, kwargs, estimated_tokens)
+
+        correction = 0
+        try:
+            raw_body = await clients.read_body(response['body'])
+            response['body'] = io.BytesIO(raw_body)
+            correction = token_correction(raw_body, estimated_tokens)
+        finally:
+            self.controller.release(token_correction=correction)
+        return response
+
+    async def _start_stream(self, **kwargs):
+        response = await self.client.invoke_model_with_response_stream(**kwargs)
+        stream = response['body']
+        events = stream.__aiter__()
+        try:
+            try:
+                first = await events.__anext__()
+            except StopAsyncIteration:
+                return response, events
+            error = clients.stream_error(first)
+            if error is not None:
+                raise error
+        except BaseException:
+            await clients.close_stream(stream)
+            raise
+        return response, _prepend(first, events)
+
+    async def invoke_model_with_response_stream(self, **kwargs):
+        estimated_tokens = estimate_request_tokens(kwargs.get('body', '{}'))
+        response, events = await self._invoke(self._start_stream, kwargs, estimated_tokens)
+        response['body'] = AsyncReleasingEventStream(response['body'], self.controller, estimated_tokens, events)
+        return response
+
+
+async def _prepend(first, events):
+    yield first
+    async for event in events:
+        yield event
+
+
+class ReleasingEventStream:
+    """Wraps a Bedrock event stream so its RateController slot is released once the stream is read or closed.
+
+    events, if given, are read in place of the stream (e.g. with its first event
+    already taken). A throttle later in the stream is counted when the slot is released.
+    """
+
+    def __init__(self, stream, controller, estimated_tokens, events=None):
+        self.stream = stream
+        self.controller = controller
+        self.estimated_tokens = estimated_tokens
+        self.events = stream if events is None else events
+        self.usage = {}
+        self._throttled = False
+        self._released = False
+
+    def __iter__(self):
+        try:
+            for event in self.events:
+                self._observe(event)
+                yield event
+        except ClientError as e:
+            # botocore raises error events rather than yielding them.
+            self._throttled = is_throttle_error(e)
+            raise
+        finally:
+            self.close()
+
+    def _observe(self, event):
+        error = clients.stream_error(event)
+        if error is not None:
+            self._throttled = is_throttle_error(error)
+            return
+        chunk = event.get('chunk')
+        if chunk and b'"usage"' in chunk['bytes']:
+            payload = json.loads(chunk['bytes'])
+            self.usage.update(payload.get('message', payload).get('usage', {}))
+
+    def _release(self):
+        # A stream closed early never reports its output tokens, so only settle complete ones.
+        actual_tokens = self.usage.get('input_tokens', 0) + self.usage.get('output_tokens', 0)
+        correction = actual_tokens - self.estimated_tokens if self.usage.get('output_tokens') else 0
+        self.controller.release(throttled=self._throttled, token_correction=correction)
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        close = getattr(self.stream, 'close', None)
+        if close is not None:
+            close()
+        self._release()
+
+
+class AsyncReleasingEventStream(ReleasingEventStream):
+    """ReleasingEventStream for an async event stream, read with `async for` and closed with aclose()."""
+
+    async def __aiter__(self):
+        try:
+            async for event in self.events:
+                self._observe(event)
+                yield event
+        except ClientError as e:
+            self._throttled = is_throttle_error(e)
+            raise
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            await clients.close_stream(self.stream)
+        finally:
+            self._release()
+
+
+def create_throttled_client(client, config, max_concurrency):
+    if not config.get('RATE_LIMIT_ENABLED', True):
+        return client, None
+
+    controller = RateController(
+        requests_per_minute=config.get('RATE_LIMIT_RPM', 500),
+        tokens_per_minute=config.get('RATE_LIMIT_TPM', 0),
+        max_concurrency=max_concurrency
+    )
+    # An async client gets the coroutine wrapper, which the async engine awaits.
+    client_class = AsyncThrottledBedrockClient if clients.is_async_client(client) else ThrottledBedrockClient
+    throttled_client = client_class(
+        client, controller,
+        max_retries=config.get('THROTTLE_MAX_RETRIES', 8)
+    )
+    return throttled_client, controller
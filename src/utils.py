@@ -1,14 +1,13 @@
 import re
-import boto3
 import csv
+import fnmatch
+import importlib
 import os
 import logging
-import subprocess
-import json
 
 logger = logging.getLogger(__name__)
 
-def verify_aws_environment(config):
+def verify_aws_environment(config, check_cache=None):
     logger.info("Verifying AWS environment...")
 
     # Check AWS_PROFILE environment variable
@@ -19,7 +18,7 @@ def verify_aws_environment(config):
         return False
 
     # Check AWS identity
-    if check_aws_identity():
+    if check_aws_identity(check_cache):
         logger.info("AWS identity check passed. 'isengard' found in the ARN.")
     else:
         logger.error("AWS identity check failed or 'isengard' not found in the ARN.")
@@ -29,8 +28,60 @@ def verify_aws_environment(config):
     return True
 
 
+def discover_markdown_files(directory, include=('*.md',), exclude=(), recursive=True):
+    """Lazily yield files under directory whose path relative to directory matches an include pattern.
+
+    Patterns are fnmatch-style and matched against '/'-separated relative paths;
+    '*' also matches '/', so '*.md' finds nested files too. A directory matching
+    an exclude pattern is not descended into. A subdirectory that can't be
+    listed is skipped with a warning; directory itself raises OSError.
+    """
+    stack = [(directory, '')]
+    while stack:
+        current, prefix = stack.pop()
+        subdirectories = []
+        try:
+            entries = os.scandir(current)
+        except OSError as e:
+            if current == directory:
+                raise
+            # Removed (or made unreadable) since its parent was listed.
+            logger.warning(f"Skipping {current}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                relative_path = prefix + entry.name
+                if any(fnmatch.fnmatch(relative_path, pattern) for pattern in exclude):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirectories.append((entry.path, relative_path + '/'))
+                elif any(fnmatch.fnmatch(relative_path, pattern) for pattern in include):
+                    yield entry.path
+        stack.extend(reversed(subdirectories))
+
+
+def unique_file_names(file_paths, directory):
+    """Pass file_paths through, raising ValueError at the first one whose file name was already seen.
+
+    Results, the journal, shards and XML section IDs are all keyed on the file
+    name, so two nested files with the same name (e.g. a/index.md and
+    b/index.md) can't both be processed.
+    """
+    seen = {}
+    for file_path in file_paths:
+        name = os.path.basename(file_path)
+        if name in seen:
+            raise ValueError(
+                f"{os.path.relpath(seen[name], directory)} and {os.path.relpath(file_path, directory)} are both named "
+                f"{name}; results are keyed on the file name, so leave one out with MARKDOWN_EXCLUDE "
+                f"(or set MARKDOWN_RECURSIVE: false)")
+        seen[name] = file_path
+        yield file_path
+
+
 def read_markdown_file(file_path):
-    logger = logging.getLogger(f"FileReader-{os.path.basename(file_path)}")
+    logger = logging.LoggerAdapter(logging.getLogger("FileReader"), {"doc": os.path.basename(file_path)})
     logger.info(f"Reading markdown file: {file_path}")
     with open(file_path, 'r', encoding='utf-8') as file:
         content = file.read()
@@ -39,7 +90,7 @@ def read_markdown_file(file_path):
 
 
 def save_to_csv(results, output_file):
-    logger = logging.getLogger(f"CsvWriter")
+    logger = logging.getLogger("CsvWriter")
     logger.info(f"Saving results to CSV file: {output_file}")
     with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
         fieldnames = ['File Name', 'Existing Title', 'Existing Title Length',
@@ -55,8 +106,24 @@ def save_to_csv(results, output_file):
     logger.info(f"Results saved successfully to {output_file}")
 
 
-def initialize_bedrock():
-    bedrock = boto3.client(service_name="bedrock-runtime")
+_session = None
+
+
+def get_boto3_session():
+    """Shared boto3 session, created on first use; importing boto3 alone takes a few hundred milliseconds."""
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+
+def initialize_bedrock(client_factory=None):
+    # client_factory is a "module:function" path, e.g. "fake_bedrock:create_client" for local runs without AWS
+    if client_factory:
+        module_name, _, function_name = client_factory.partition(':')
+        return getattr(importlib.import_module(module_name), function_name)()
+    bedrock = get_boto3_session().client(service_name="bedrock-runtime")
     return bedrock
 
 
@@ -80,19 +147,27 @@ def extract_title(content):
     return ""
 
 
-def check_aws_identity():
+def check_aws_identity(check_cache=None):
+    # Cached per profile, so back-to-back runs skip the STS round trip (and the boto3 import).
+    cache_key = f"identity:{os.environ.get('AWS_PROFILE', '')}"
+    if check_cache is not None:
+        arn = check_cache.get(cache_key)
+        if arn:
+            logger.info(f"Using cached AWS identity {arn}")
+            return True
+
     try:
-        result = subprocess.run(['aws', 'sts', 'get-caller-identity'], capture_output=True, text=True)
-        if result.returncode == 0:
-            identity = json.loads(result.stdout)
-            return 'isengard' in identity.get('Arn', '').lower()
-        else:
-            logging.error(f"Error checking AWS identity: {result.stderr}")
-            return False
+        identity = get_boto3_session().client('sts').get_caller_identity()
+        arn = identity.get('Arn', '')
     except Exception as e:
         logging.error(f"Error checking AWS identity: {e}")
         return False
 
+    passed = 'isengard' in arn.lower()
+    if passed and check_cache is not None:
+        check_cache.put(cache_key, arn)
+    return passed
+
 
 def extract_first_paragraph(content):
     logger = logging.getLogger('ParagraphExtractor')
@@ -0,0 +1,184 @@
+import concurrent.futures
+import logging
+import os
+import re
+import signal
+import time
+from config import get_config
+from metrics import get_run_metrics
+import generate, journal, modify, utils
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot(directory, config):
+    """{path: (mtime_ns, size)} for every markdown file a generation run would pick up."""
+    files = {}
+    for file_path in utils.unique_file_names(utils.discover_markdown_files(
+            directory,
+            include=config.get('MARKDOWN_INCLUDE', ['*.md']),
+            exclude=config.get('MARKDOWN_EXCLUDE', []),
+            recursive=config.get('MARKDOWN_RECURSIVE', True)), directory):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            # Deleted between the directory listing and the stat.
+            continue
+        files[file_path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def changed_files(before, after):
+    """Paths that are new or modified in `after`; deleted files need no regeneration."""
+    return sorted(path for path, signature in after.items() if before.get(path) != signature)
+
+
+class MarkdownWatcher:
+    """Regenerates changed markdown files and patches their sections in XML_DIRECTORY as they change.
+
+    The tree is polled every WATCH_POLL_SECONDS by comparing mtime/size
+    snapshots, so no file system notification service is needed. Once a change
+    is seen, polling continues until the tree has been quiet for
+    WATCH_DEBOUNCE_SECONDS, and everything that changed in that burst is handled
+    as one cycle on a worker pool (and Bedrock client) that stays up between cycles.
+    """
+
+    def __init__(self, directory, bedrock_client, result_cache=None, result_journal=None, index=None, config=None):
+        config = config or get_config()
+        self.config = config
+        self.directory = directory
+        self.bedrock_client = bedrock_client
+        self.result_cache = result_cache
+        self.result_journal = result_journal
+        self.index = index
+        self.xml_directory = config.get('XML_DIRECTORY')
+        self.output_csv = config['OUTPUT_CSV_FILE']
+        self.poll_seconds = config.get('WATCH_POLL_SECONDS', 1.0)
+        self.debounce_seconds = config.get('WATCH_DEBOUNCE_SECONDS', 2.0)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=config['MAX_WORKERS'])
+        self.cycles = 0
+        self.baseline = snapshot(directory, config)
+        logger.info(f"Watching {len(self.baseline)} markdown files in {directory}")
+
+        if self.xml_directory and not os.path.isdir(self.xml_directory):
+            logger.warning(f"XML_DIRECTORY {self.xml_directory} does not exist, changes will only be regenerated")
+            self.xml_directory = None
+
+    def _snapshot(self):
+        """snapshot() of the watched tree, or None (logged) if it can't be listed right now.
+
+        That is while the tree is being replaced, or while it has two files with
+        the same name; the previous snapshot stays in place until it is fixed.
+        """
+        try:
+            return snapshot(self.directory, self.config)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not list {self.directory}, retrying in {self.poll_seconds}s: {e}")
+            return None
+
+    def wait_for_changes(self):
+        """Block until a burst of changes has settled; returns (changed paths, monotonic time of the first change)."""
+        while True:
+            time.sleep(self.poll_seconds)
+            current = self._snapshot()
+            if current is None or current == self.baseline:
+                continue
+
+            first_change = last_change = time.monotonic()
+            while time.monotonic() - last_change < self.debounce_seconds:
+                time.sleep(self.poll_seconds)
+                latest = self._snapshot()
+                if latest is not None and latest != current:
+                    current = latest
+                    last_change = time.monotonic()
+
+            changed = changed_files(self.baseline, current)
+            self.baseline = current
+            if changed:
+                return changed, first_change
+
+    def run_cycle(self, file_paths, first_change=None):
+        """Regenerate file_paths and patch their sections; returns a summary dict of the cycle."""
+        run_metrics = get_run_metrics()
+        start = time.monotonic()
+        self.cycles += 1
+
+        results = []
+        for result in self.executor.map(
+                lambda file_path: generate.process_single_file(file_path, self.bedrock_client, self.result_cache,
+                                                               self.config),
+                file_paths):
+            if result:
+                results.append(result)
+                run_metrics.increment("files_processed")
+                if self.result_journal is not None:
+                    self.result_journal.append(result)
+        generated = time.monotonic()
+        run_metrics.record_stage("watch_generate", generated - start)
+
+        rows = {re.sub(r'\.md$', '', result['File Name']): (result['AI Generated Title'],
+                                                              result['AI Generated Abstract'])
+                for result in results if result['AI Generated Title'] and result['AI Generated Abstract']}
+        report = None
+        if rows and self.xml_directory:
+            # A handful of files, so the process pool would cost more than it saves.
+            report = modify.apply_rows(rows, self.xml_directory, workers=1, index=self.index, replace=True)
+        patched = time.monotonic()
+        run_metrics.record_stage("watch_patch", patched - generated)
+
+        if self.result_journal is not None:
+            self.result_journal.sync()
+            utils.save_to_csv(journal.read_journal(self.result_journal.path, latest=True), self.output_csv)
+
+        end = time.monotonic()
+        run_metrics.record_stage("watch_cycle", end - start)
+        cycle = {
+            "cycle": self.cycles,
+            "changed_files": len(file_paths),
+            "regenerated": len(results),
+            "sections_patched": len(report["added"]) + len(report["replaced"]) if report else 0,
+            "xml_files_modified": len(report["modified_files"]) if report else 0,
+            "missing_from_xml": report["missing_from_xml"] if report else [],
+            "generate_seconds": round(generated - start, 3),
+            "patch_seconds": round(patched - generated, 3),
+            "cycle_seconds": round(end - start, 3),
+        }
+        if first_change is not None:
+            # Includes the debounce wait, i.e. how long an edit took to show up in the XML.
+            cycle["change_to_patch_seconds"] = round(end - first_change, 3)
+            run_metrics.record_stage("watch_change_to_patch", end - first_change)
+        return cycle
+
+    def run(self, max_cycles=None):
+        """Watch until interrupted or sent SIGTERM (or for max_cycles cycles)."""
+        previous_handler = signal.signal(signal.SIGTERM, _stop_watching)
+        try:
+            while max_cycles is None or self.cycles < max_cycles:
+                file_paths, first_change = self.wait_for_changes()
+                logger.info(f"{len(file_paths)} markdown files changed: {', '.join(map(os.path.basename, file_paths))}")
+                cycle = self.run_cycle(file_paths, first_change)
+                summary = format_cycle(cycle)
+                print(summary)
+                logger.info(summary)
+                if cycle["missing_from_xml"]:
+                    logger.warning(f"Changed section IDs not found in any XML file: {', '.join(cycle['missing_from_xml'])}")
+        except KeyboardInterrupt:
+            logger.info(f"Stopped watching after {self.cycles} cycles")
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            self.executor.shutdown(wait=True)
+
+
+def _stop_watching(signum, frame):
+    # Stop a daemonised watcher the same way as Ctrl-C, so the run report and CSV are still written.
+    raise KeyboardInterrupt
+
+
+def format_cycle(cycle):
+    line = (f"Cycle {cycle['cycle']}: {cycle['regenerated']}/{cycle['changed_files']} changed files regenerated, "
+            f"{cycle['sections_patched']} sections patched in {cycle['xml_files_modified']} XML files "
+            f"(generate {cycle['generate_seconds']:.2f}s, patch {cycle['patch_seconds']:.2f}s, "
+            f"cycle {cycle['cycle_seconds']:.2f}s")
+    if "change_to_patch_seconds" in cycle:
+        line += f", {cycle['change_to_patch_seconds']:.2f}s after the first change"
+    return line + ")"
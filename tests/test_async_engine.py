@@ -0,0 +1,84 @@
+import threading
+import pytest
+import yaml
+import async_generate
+import clients
+import config as config_module
+import fake_bedrock
+import hedging
+import jobs
+import metrics
+import prompts
+import throttle
+
+FILES = 20
+MAX_IN_FLIGHT = 8
+
+
+def _load_config(tmp_path, **overrides):
+    markdown_directory = tmp_path / "markdown"
+    markdown_directory.mkdir()
+    for i in range(FILES):
+        (markdown_directory / f"page-{i}.md").write_text(f"# Page {i}\n\nAbout page {i}.\n", encoding='utf-8')
+
+    settings = {
+        "SERVICE_NAME": "Amazon EKS",
+        "BEDROCK_MODEL": "anthropic.claude-3-sonnet-20240229-v1:0",
+        "MARKDOWN_DIRECTORY": str(markdown_directory),
+        "MAX_FILES": 1000,
+        "MAX_IN_FLIGHT": MAX_IN_FLIGHT,
+        "BEDROCK_CLIENT_FACTORY": "fake_bedrock:create_async_client",
+        "FAKE_BEDROCK_LATENCY_MS": 5,
+        "FAKE_BEDROCK_THROTTLE_RATE": 0.05,
+        "FAKE_BEDROCK_SEED": 1,
+        "RATE_LIMIT_ENABLED": True,
+        "RATE_LIMIT_RPM": 100000,
+        "BEDROCK_CALL_DEADLINE_SECONDS": 10,
+        "FILE_DEADLINE_SECONDS": 30,
+        "HEDGING_ENABLED": True,
+        "HEDGE_PERCENTILE": 50,
+        "HEDGE_MIN_SAMPLES": 5,
+        "CACHE_ENABLED": False,
+    }
+    settings.update(overrides)
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump(settings), encoding='utf-8')
+    config_module.load_config(str(path))
+    return config_module.get_config()
+
+
+@pytest.mark.parametrize("overrides", [{}, {"STREAMING_ENABLED": True}, {"FUSED_GENERATION_ENABLED": True}],
+                         ids=["invoke", "streaming", "fused"])
+def test_async_client_runs_through_throttle_and_hedging_on_the_event_loop(tmp_path, overrides):
+    config = _load_config(tmp_path, **overrides)
+    # Built as main() builds it for ENGINE: async.
+    raw_client, _ = clients.create_bedrock_client(config, MAX_IN_FLIGHT)
+    bedrock_client, rate_controller = throttle.create_throttled_client(raw_client, config, MAX_IN_FLIGHT)
+    bedrock_client, hedged_client = hedging.create_hedged_client(
+        bedrock_client, raw_client, rate_controller, config, MAX_IN_FLIGHT)
+    assert isinstance(raw_client, fake_bedrock.AsyncFakeBedrockClient)
+    assert isinstance(hedged_client, hedging.AsyncHedgedBedrockClient)
+    assert isinstance(hedged_client.client, throttle.AsyncThrottledBedrockClient)
+
+    prompts.validate_bedrock_connection(bedrock_client, config['BEDROCK_MODEL'])
+    metrics.start_run()
+    threads_before = {thread.ident for thread in threading.enumerate()}
+    job = jobs.Job(config)
+    async_generate.process_jobs_async([job], bedrock_client, MAX_IN_FLIGHT)
+
+    assert job.failed == 0
+    assert sorted(result["File Name"] for result in job.results) == sorted(f"page-{i}.md" for i in range(FILES))
+    for result in job.results:
+        assert result["AI Generated Abstract"] == f"Learn how to use {result['File Name']} to get work done."
+        assert result["AI Generated Title"] == f"Use {result['Existing Title']}"
+
+    # Every call went through the rate controller and was released, including throttled and cancelled ones.
+    assert raw_client.throttles > 0
+    assert rate_controller.requests >= raw_client.calls - raw_client.throttles
+    assert rate_controller.in_flight == 0
+    assert raw_client.in_flight == 0
+    assert raw_client.max_in_flight <= MAX_IN_FLIGHT + hedged_client.hedges
+    # No worker threads: neither the in-flight limiter nor the hedging client needed a pool.
+    assert hedged_client._executor is None
+    assert not [thread for thread in threading.enumerate()
+                if thread.ident not in threads_before and thread.name.startswith("bedrock")]
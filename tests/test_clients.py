@@ -0,0 +1,43 @@
+import json
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+import clients
+import throttle
+import utils
+
+
+class _Body:
+    def __init__(self, data):
+        self.data = data
+
+    def stream(self, **kwargs):
+        yield self.data
+
+
+def test_throttle_reaches_rate_controller_on_the_first_attempt(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setattr(utils, "_session", None)
+    config = {"RATE_LIMIT_ENABLED": True, "RATE_LIMIT_RPM": 0, "THROTTLE_MAX_RETRIES": 0}
+    client, _ = clients.create_bedrock_client(config, 4)
+
+    sent = []
+
+    def throttled_response(request, **kwargs):
+        sent.append(request.url)
+        body = json.dumps({"message": "Too many requests"}).encode('utf-8')
+        return AWSResponse(request.url, 429, {"x-amzn-ErrorType": "ThrottlingException"}, _Body(body))
+
+    client.meta.events.register('before-send.bedrock-runtime', throttled_response)
+    throttled_client, controller = throttle.create_throttled_client(client, config, 4)
+
+    with pytest.raises(ClientError) as error:
+        throttled_client.invoke_model(body=json.dumps({"messages": []}), modelId="model")
+
+    assert error.value.response["Error"]["Code"] == "ThrottlingException"
+    # botocore made one attempt, so the RateController saw the throttle straight away.
+    assert len(sent) == 1
+    assert controller.throttles == 1
+    assert controller.limit < 4
@@ -0,0 +1,70 @@
+import json
+import yaml
+import config as config_module
+import fake_bedrock
+import generate
+import jobs
+import journal
+import metrics
+
+
+def _result(name):
+    return {"File Name": name, "AI Generated Abstract": f"About {name}.", "AI Generated Title": f"Use {name}"}
+
+
+def _crashed_journal(path):
+    with journal.ResultJournal(str(path)) as result_journal:
+        for name in ("a.md", "b.md"):
+            result_journal.append(_result(name))
+    # A crash part way through writing the next result.
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(_result("c.md"))[:20])
+
+
+def test_torn_last_line_is_skipped_and_resume_starts_a_new_line(tmp_path):
+    path = tmp_path / "results.csv.journal.jsonl"
+    _crashed_journal(path)
+
+    assert [result["File Name"] for result in journal.read_journal(str(path))] == ["a.md", "b.md"]
+    assert journal.completed_files(str(path)) == {"a.md", "b.md"}
+
+    with journal.ResultJournal(str(path), resume=True) as result_journal:
+        result_journal.append(_result("c.md"))
+        result_journal.append(_result("a.md"))
+    # The torn line stays unreadable, c.md is intact after it, and the first a.md result wins.
+    results = list(journal.read_journal(str(path)))
+    assert [result["File Name"] for result in results] == ["a.md", "b.md", "c.md"]
+    assert results[0] == _result("a.md")
+
+
+def test_resume_skips_completed_files(tmp_path):
+    markdown_directory = tmp_path / "markdown"
+    markdown_directory.mkdir()
+    for name in ("a", "b", "c", "d"):
+        (markdown_directory / f"{name}.md").write_text(f"# Page {name}\n\nAbout {name}.\n", encoding='utf-8')
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.safe_dump({
+        "SERVICE_NAME": "Amazon EKS",
+        "BEDROCK_MODEL": "anthropic.claude-3-sonnet-20240229-v1:0",
+        "MARKDOWN_DIRECTORY": str(markdown_directory),
+        "OUTPUT_CSV_FILE": str(tmp_path / "results.csv"),
+        "MAX_FILES": 1000,
+        "MAX_WORKERS": 2,
+        "CACHE_ENABLED": False,
+    }), encoding='utf-8')
+    config_module.load_config(str(config_path))
+    config = config_module.get_config()
+    path = journal.journal_path(config)
+    _crashed_journal(path)
+
+    metrics.start_run()
+    completed = journal.completed_files(path)
+    client = fake_bedrock.FakeBedrockClient()
+    with journal.ResultJournal(path, resume=True) as result_journal:
+        job = jobs.Job(config, journal=result_journal, completed=completed)
+        generate.process_jobs([job], client, config["MAX_WORKERS"])
+
+    assert job.processed == 2 and job.failed == 0
+    # Only the two files missing from the journal were sent, two requests each.
+    assert client.calls == 4
+    assert sorted(result["File Name"] for result in journal.read_journal(path)) == ["a.md", "b.md", "c.md", "d.md"]
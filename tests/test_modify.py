@@ -0,0 +1,36 @@
+import filecmp
+import os
+import shutil
+import stat
+import pytest
+import modify
+import section_index
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "modify")
+XML_FILES = ["guide.xml", "nested/nodes.xml", "nested/unchanged.xml"]
+
+
+@pytest.mark.parametrize("workers, use_index", [(1, False), (2, False), (1, True)],
+                         ids=["serial", "process-pool", "section-index"])
+def test_rewritten_xml_is_byte_identical_to_the_golden_files(tmp_path, workers, use_index):
+    # The golden files are what the original per-section insert loop wrote for rows.csv.
+    xml_directory = tmp_path / "xml"
+    shutil.copytree(os.path.join(DATA, "input"), xml_directory)
+    os.chmod(xml_directory / "guide.xml", 0o640)
+    index = section_index.SectionIndex(str(tmp_path / "index.json")) if use_index else None
+
+    report = modify.modify_xml_files(os.path.join(DATA, "rows.csv"), str(xml_directory), workers=workers, index=index)
+
+    for name in XML_FILES:
+        assert filecmp.cmp(xml_directory / name, os.path.join(DATA, "expected", name), shallow=False), name
+    assert sorted(report["added"]) == ["create-cluster", "create-node-group", "multi-line-tag"]
+    assert report["existing"] == ["delete-cluster"]
+    # write_atomic replaces the file, but keeps its permissions.
+    assert stat.S_IMODE(os.stat(xml_directory / "guide.xml").st_mode) == 0o640
+    assert not [name for name in os.listdir(xml_directory) if name.endswith(".tmp")]
+
+    # A second run finds the generated content already in place.
+    report = modify.modify_xml_files(os.path.join(DATA, "rows.csv"), str(xml_directory), workers=workers, index=index)
+    assert report["added"] == [] and report["modified_files"] == []
+    for name in XML_FILES:
+        assert filecmp.cmp(xml_directory / name, os.path.join(DATA, "expected", name), shallow=False), name
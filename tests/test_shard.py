@@ -0,0 +1,33 @@
+import csv
+import shard
+import utils
+
+
+def _result(name, abstract):
+    return {"File Name": name, "Existing Title": name, "AI Generated Abstract": abstract, "AI Generated Title": name}
+
+
+def test_merge_reports_duplicate_and_missing_files(tmp_path):
+    shard_0 = str(tmp_path / "results.shard-0-of-2.csv")
+    shard_1 = str(tmp_path / "results.shard-1-of-2.csv")
+    utils.save_to_csv([_result("a.md", "first"), _result("b.md", "first")], shard_0)
+    utils.save_to_csv([_result("b.md", "second"), _result("c.md", "first")], shard_1)
+    output = str(tmp_path / "results.csv")
+
+    merged, duplicates, missing = shard.merge_shard_csvs([shard_0, shard_1], output, {"a.md", "b.md", "c.md", "d.md"})
+
+    assert merged == 3
+    assert duplicates == ["b.md"]
+    assert missing == ["d.md"]
+    with open(output, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    # The first shard's row for a duplicated file is kept.
+    assert [(row["File Name"], row["AI Generated Abstract"]) for row in rows] == [
+        ("a.md", "first"), ("b.md", "first"), ("c.md", "first")]
+
+
+def test_every_file_is_in_exactly_one_shard():
+    names = [f"page-{i}.md" for i in range(200)]
+    for count in (1, 3, 8):
+        shards = [[name for name in names if shard.in_shard(name, (index, count))] for index in range(count)]
+        assert sorted(sum(shards, [])) == sorted(names)